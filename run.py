@@ -1,7 +1,7 @@
 """CLI for running the log analysis pipeline."""
 
-import json
 import logging
+import os
 from pathlib import Path
 from typing import List, Dict, Any
 
@@ -12,11 +12,15 @@ from src.log_analyzer_rag.main_process import process_and_analyze_logs
 from src.log_analyzer_rag.rag_pipeline.llm import COST_TRACKER
 from src.log_analyzer_rag.rag_pipeline.vector_store import VECTOR_DB
 from src.log_analyzer_rag.utils.file_tracker import save_log_state, STATE
+from src.log_analyzer_rag.utils.results_sink import RESULTS_SINK, ResultsSink
 
 # 初始化日誌記錄器
 setup_logging()
 logger = logging.getLogger(__name__)
 
+# 要處理的日誌檔案副檔名
+LOG_FILE_SUFFIXES = (".log", ".gz", ".bz2")
+
 
 def find_log_files(target_dir: Path) -> List[Path]:
     """從目標目錄中尋找要處理的日誌檔案"""
@@ -28,10 +32,13 @@ def find_log_files(target_dir: Path) -> List[Path]:
         return []
 
     logger.info(f"正在掃描日誌目錄: {target_dir}")
-    log_files = [
-        item for item in target_dir.iterdir()
-        if item.is_file() and item.suffix.lower() in [".log", ".gz", ".bz2"]
-    ]
+    # os.scandir 的 DirEntry 會快取檔案類型，只有符合條件的項目才建立 Path
+    with os.scandir(target_dir) as entries:
+        log_files = [
+            Path(entry.path) for entry in entries
+            if entry.is_file()
+            and entry.name.lower().endswith(LOG_FILE_SUFFIXES)
+        ]
 
     if not log_files:
         logger.info(f"在 {target_dir} 中未找到符合條件 (.log, .gz, .bz2) 的日誌檔案。")
@@ -40,19 +47,16 @@ def find_log_files(target_dir: Path) -> List[Path]:
     return log_files
 
 
-def export_results(results: List[Dict[str, Any]], output_file: Path):
-    """將分析結果匯出成 NDJSON 檔案 (一行一筆 JSON)。"""
+def export_results(results: List[Dict[str, Any]], sink: ResultsSink):
+    """將分析結果附加寫入 NDJSON 結果檔 (一行一筆 JSON)。"""
     if not results:
         logger.info("本次執行沒有產生新的可匯出的結構化分析結果。")
         return
 
+    output_file = sink.output_file
     logger.info(f"準備將 {len(results)} 筆結構化分析結果匯出至 {output_file}")
     try:
-        output_file.parent.mkdir(parents=True, exist_ok=True)
-        with open(output_file, "a", encoding="utf-8") as f_out:
-            for rec in results:
-                json_line = json.dumps(rec, ensure_ascii=False)
-                f_out.write(json_line + "\n")
+        sink.write(results)
         logger.info(f"分析結果已成功匯出至 {output_file}")
     except PermissionError:
         logger.critical(
@@ -93,7 +97,7 @@ def main():
         logger.info("程式即將結束，正在儲存最終狀態...")
         save_log_state(STATE)
         VECTOR_DB.save()
-        export_results(all_exported_data, settings.LMS_ANALYSIS_OUTPUT_FILE)
+        export_results(all_exported_data, RESULTS_SINK)
     except Exception as final_save_e:
         logger.error(f"結束前儲存狀態或匯出結果時發生錯誤: {final_save_e}", exc_info=True)
     finally:
@@ -6,6 +6,7 @@
 並提供 ``settings`` 物件供其他模組使用。
 """
 
+import functools
 import os
 from pathlib import Path
 from typing import Optional
@@ -46,6 +47,8 @@ class Settings(BaseSettings):
     LMS_OPERATIONAL_LOG_FILE: Path = BASE_DIR / "analyzer_script.log"
     # 存放日誌檔案讀取進度 (inode/offset) 的狀態檔路徑
     LOG_STATE_FILE: Path = DATA_DIR / "file_state.json"
+    # 讀取進度有變動時，兩次寫入狀態檔之間的最短間隔 (秒)
+    STATE_FLUSH_INTERVAL_S: float = 30.0
     # FAISS 向量索引檔案的儲存路徑
     VECTOR_DB_PATH: Path = DATA_DIR / "faiss.index"
 
@@ -56,6 +59,14 @@ class Settings(BaseSettings):
     EMBEDDING_MODEL_NAME: str = 'paraphrase-multilingual-MiniLM-L12-v2'
     # 要使用的 LLM 模型名稱
     LLM_MODEL_NAME: str = "llama3"
+    # Ollama 在最後一次請求後保留模型 (及系統提示 KV cache) 於記憶體中的時間
+    LLM_KEEP_ALIVE: str = "10m"
+    # 單一 LLM 請求的逾時秒數
+    LLM_REQUEST_TIMEOUT_S: float = 120.0
+    # 同時送往 Ollama 的最大請求數 (需搭配伺服器端的 OLLAMA_NUM_PARALLEL)
+    LLM_MAX_CONCURRENCY: int = 4
+    # 第一次分析前是否先送出預熱請求，讓 Ollama 載入模型並快取系統指示的 KV cache
+    LLM_WARMUP: bool = True
     # 嵌入向量的維度 (預設值，會被 embedding.py 中的模型實際維度動態覆蓋)
     EMBED_DIM: int = 384
 
@@ -66,8 +77,12 @@ class Settings(BaseSettings):
     LMS_CACHE_SIZE: int = 10_000
     # 啟發式評分後，取分數最高的日誌百分比進行深度分析
     LMS_SAMPLE_TOP_PERCENT: int = 20
+    # 串流評分時每個區塊的行數，決定評分階段的記憶體峰值
+    LMS_SCORE_CHUNK_SIZE: int = 10_000
     # 批次呼叫 LLM 分析的日誌數量
     LMS_LLM_BATCH_SIZE: int = 10
+    # 並行讀取日誌檔案的最大執行緒數
+    LMS_MAX_READ_WORKERS: int = 8
     # 每小時 LLM API 的費用上限 (美元)
     LMS_MAX_HOURLY_COST_USD: float = 5.0
     # LLM 輸入 token 的價格 (每 1000 tokens)
@@ -83,6 +98,36 @@ class Settings(BaseSettings):
     # 用於判斷與已知正常模式相似的 L2 距離閾值
     SIM_N_NORMAL_L2_THRESHOLD: float = 0.2
 
+    # --------------------------------------------------------------------------
+    # 語意快取
+    # --------------------------------------------------------------------------
+    # 精確快取未命中時，是否以嵌入向量尋找語意相近且已分析過的日誌並直接沿用其結果
+    SEMANTIC_CACHE_ENABLED: bool = True
+    # 沿用既有分析結果所需的最低餘弦相似度
+    SEMANTIC_CACHE_THRESHOLD: float = 0.97
+
+    # --------------------------------------------------------------------------
+    # FAISS 索引設定
+    # --------------------------------------------------------------------------
+    # FAISS 搜尋使用的 OpenMP 執行緒數；0 表示沿用 OMP_NUM_THREADS，未設定時使用邏輯核心數的一半 (約等於實體核心數)
+    FAISS_NUM_THREADS: int = 0
+    # 新建立索引的類型: "flat" (精確搜尋)、"hnsw" (圖索引，免訓練) 或 "ivfpq" (分群 + 乘積量化，需訓練)
+    FAISS_INDEX_TYPE: str = "flat"
+    # 是否以 8-bit 純量量化 (IndexScalarQuantizer) 儲存向量，記憶體與頻寬約為 float32 的 1/4
+    # 注意：僅影響新建立的 flat 索引；量化後距離分佈略有偏移，相似度閾值可能需要重新校正
+    FAISS_QUANTIZE: bool = False
+    # 需要訓練的索引 (8-bit 量化 / IVFPQ) 先暫存到此筆數再訓練 (IVFPQ 另需不少於 FAISS_IVF_NLIST)；
+    # 未達此筆數時暫存向量會存入索引旁的 .pending.npy，下次執行繼續累積
+    FAISS_TRAIN_MIN_VECTORS: int = 10_000
+    # 新增向量時先暫存，累積達此筆數才一次寫入 FAISS
+    FAISS_ADD_FLUSH: int = 4096
+    # HNSW 查詢時的候選清單大小，越大越精確但越慢
+    HNSW_EF_SEARCH: int = 64
+    # IVFPQ 的分群數量；訓練向量數需不少於此值
+    FAISS_IVF_NLIST: int = 1024
+    # IVFPQ 查詢時探訪的分群數量
+    IVF_NPROBE: int = 16
+
     # Pydantic-settings 的 model_config
     model_config = SettingsConfigDict(
         env_file=".env",              # 指定讀取 .env 檔案
@@ -95,16 +140,19 @@ class Settings(BaseSettings):
 settings = Settings()
 
 # --- 目錄初始化 ---
-# 在程式啟動時，確保所有需要的資料目錄都存在
-try:
-    settings.DATA_DIR.mkdir(parents=True, exist_ok=True)
-    
-    # 檢查並建立非標準的父目錄
-    if not settings.LMS_ANALYSIS_OUTPUT_FILE.parent.exists():
+@functools.cache
+def ensure_dirs() -> None:
+    """
+    確保所有需要的資料與日誌目錄都存在。
+
+    只在程式進入點 (setup_logging、process_and_analyze_logs) 呼叫，
+    並以 functools.cache 保證每個行程最多執行一次，單純 import 本模組不會觸發任何檔案系統操作。
+    """
+    try:
+        # exist_ok=True 已涵蓋目錄存在的情況，不需要事先 exists() 檢查
+        settings.DATA_DIR.mkdir(parents=True, exist_ok=True)
         settings.LMS_ANALYSIS_OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
-    
-    if not settings.LMS_OPERATIONAL_LOG_FILE.parent.exists():
         settings.LMS_OPERATIONAL_LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
-except Exception as e:
-    # 在無法建立目錄時給出提示，通常是權限問題
-    print(f"[CRITICAL] 無法建立必要的資料或日誌目錄，請檢查權限: {e}")
+    except Exception as e:
+        # 在無法建立目錄時給出提示，通常是權限問題
+        print(f"[CRITICAL] 無法建立必要的資料或日誌目錄，請檢查權限: {e}")
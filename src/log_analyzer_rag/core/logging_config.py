@@ -2,10 +2,11 @@
 
 import logging
 import sys
-from .config import settings
+from .config import ensure_dirs, settings
 
 def setup_logging():
     """設定全域日誌記錄器"""
+    ensure_dirs()
     log_handlers: list[logging.Handler] = [logging.StreamHandler(sys.stdout)]
     try:
         # 使用 'a' 模式來附加日誌，而不是每次覆寫
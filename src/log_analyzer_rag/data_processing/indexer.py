@@ -1,49 +1,105 @@
 """Utilities for scoring log lines and updating the FAISS index."""
 
+import itertools
 import logging
-from typing import List, Tuple
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
 
 from ..core.config import settings
-from .scoring import fast_score
+from .scoring import fast_score_batch
 from ..rag_pipeline.embedding import embed_lines
 from ..rag_pipeline.vector_store import VECTOR_DB
 
 logger = logging.getLogger(__name__)
 
-def update_vector_index(new_log_lines: List[str]) -> List[Tuple[float, str]]:
+def score_candidates(lines: Iterable[str]) -> Tuple[np.ndarray, List[str], int]:
+    """
+    以固定大小的區塊串流評分日誌，只保留啟發式分數大於 0 的候選行。
+
+    輸入可以是產生器 (例如 ``iter_since``)，因此不需要先把所有新日誌載入記憶體；
+    記憶體用量只與候選行數量成正比。
+
+    Returns:
+        (候選分數陣列, 候選日誌列表, 讀取的總行數)。候選行維持原始順序。
+    """
+    score_chunks: List[np.ndarray] = []
+    candidates: List[str] = []
+    total = 0
+    it = iter(lines)
+    while True:
+        chunk = list(itertools.islice(it, settings.LMS_SCORE_CHUNK_SIZE))
+        if not chunk:
+            break
+        total += len(chunk)
+        chunk_scores = fast_score_batch(chunk)
+        keep = np.flatnonzero(chunk_scores > 0.0)
+        if keep.size:
+            score_chunks.append(chunk_scores[keep])
+            candidates.extend(chunk[i] for i in keep)
+    scores = np.concatenate(score_chunks) if score_chunks else np.empty(0, dtype=np.float32)
+    return scores, candidates, total
+
+
+def update_vector_index(new_log_lines: Iterable[str]) -> List[Tuple[float, str]]:
     """
     對新增的日誌進行評分、抽樣、向量化並更新至 FAISS 索引。
 
     這個函式是 RAG 流程中 "Retrieval" 的基礎建設部分。
 
     Args:
-        new_log_lines: 從日誌檔案中讀取到的新日誌行列表。
+        new_log_lines: 從日誌檔案中讀取到的新日誌行，可以是列表或產生器。
 
     Returns:
         一個元組列表，包含被選中進行深度分析的日誌及其啟發式分數。
         格式為 [(score, line_content), ...]。
         如果沒有日誌被選中，則回傳空列表。
     """
-    if not new_log_lines:
-        return []
-
     # 1. 快速評分
-    logger.info(f"對 {len(new_log_lines)} 行新日誌進行啟發式評分...")
-    scored_lines = sorted(
-        [(fast_score(line), line) for line in new_log_lines],
-        key=lambda x: x[0],
-        reverse=True
-    )
+    scores, candidates, total = score_candidates(new_log_lines)
+    if total:
+        logger.info(f"已對 {total} 行新日誌進行啟發式評分，其中 {len(candidates)} 行分數大於 0。")
+    top_scored_lines, _ = index_candidates(scores, candidates)
+    return top_scored_lines
+
 
+def index_candidates(
+    scores: np.ndarray, candidates: List[str]
+) -> Tuple[List[Tuple[float, str]], Dict[str, Tuple[int, np.ndarray]]]:
+    """
+    從 ``score_candidates`` 產生的候選行中抽樣高分日誌，向量化並更新至 FAISS 索引。
+
+    Args:
+        scores: 候選行的啟發式分數 (皆大於 0)。
+        candidates: 與 ``scores`` 對應的候選日誌行。
+
+    Returns:
+        (與 ``update_vector_index`` 相同格式的 [(score, line_content), ...],
+        已索引的日誌 -> (FAISS 向量 id, 嵌入向量))。後者交給 ``llm_analyse``，
+        讓語意快取沿用同一組向量並將分析結果附加到這些向量上，不必重新嵌入。
+    """
     # 2. 抽樣高分日誌
     # 取分數大於 0 的日誌，再取前 N%
-    positive_scored_lines = [sl for sl in scored_lines if sl[0] > 0.0]
-    if not positive_scored_lines:
+    if not candidates:
         logger.info("所有新日誌的啟發式評分均為0，無需建立索引。")
-        return []
+        return [], {}
 
-    num_to_sample = max(1, int(len(positive_scored_lines) * settings.LMS_SAMPLE_TOP_PERCENT / 100))
-    top_scored_lines_to_index = positive_scored_lines[:num_to_sample]
+    num_positive = len(candidates)
+    num_to_sample = max(1, int(num_positive * settings.LMS_SAMPLE_TOP_PERCENT / 100))
+    # 只需要前 K 名：先以 partition 在 O(N) 內找出第 K 高的分數，再僅對這 K 筆排序。
+    # 分數是 0.1 的倍數，第 K 名幾乎總有同分者；與原本的穩定排序相同，同分時取行序較前者
+    if num_to_sample < num_positive:
+        kth_score = np.partition(scores, num_positive - num_to_sample)[num_positive - num_to_sample]
+        above = np.flatnonzero(scores > kth_score)
+        tied = np.flatnonzero(scores == kth_score)[: num_to_sample - above.size]
+        top_idx = np.concatenate([above, tied])
+    else:
+        top_idx = np.arange(num_positive)
+    # 選出的 K 筆依分數由高到低排列，分數相同時依原始行序
+    top_idx = top_idx[np.lexsort((top_idx, -scores[top_idx]))]
+    top_scored_lines_to_index = [
+        (float(scores[i]), candidates[i]) for i in top_idx
+    ]
 
     top_lines_content = [line_content for _, line_content in top_scored_lines_to_index]
     logger.info(
@@ -52,20 +108,28 @@ def update_vector_index(new_log_lines: List[str]) -> List[Tuple[float, str]]:
     )
 
     # 3. 產生 Embedding 並更新向量索引
-    if VECTOR_DB.index is not None:
+    line_vectors: Dict[str, Tuple[int, np.ndarray]] = {}
+    if VECTOR_DB.enabled:
         try:
             logger.info("正在產生文字嵌入向量...")
-            line_embeddings = embed_lines(top_lines_content)
+            # 重複的日誌 (例如健康檢查、掃描器的固定請求) 只需嵌入並索引一次
+            unique_lines = list(dict.fromkeys(top_lines_content))
+            line_embeddings = embed_lines(unique_lines)
 
-            if line_embeddings:
+            if len(line_embeddings):
                 logger.info("正在將新向量新增至 FAISS 索引...")
-                VECTOR_DB.add(line_embeddings)
-                logger.info(f"成功將 {len(line_embeddings)} 個新向量存入 FAISS。")
+                vector_ids = VECTOR_DB.add(line_embeddings)
+                if vector_ids is not None:
+                    line_vectors = {
+                        line: (int(vec_id), emb)
+                        for line, vec_id, emb in zip(unique_lines, vector_ids, line_embeddings)
+                    }
+                    logger.info(f"成功將 {len(line_embeddings)} 個新向量存入 FAISS。")
 
         except Exception as e:
             logger.error(f"產生 embedding 或存入 FAISS 時發生錯誤: {e}", exc_info=True)
     else:
-        logger.warning("FAISS 未啟用或索引未初始化，跳過 embedding 和向量索引更新。")
+        logger.warning("FAISS 未啟用，跳過 embedding 和向量索引更新。")
 
-    # 4. 回傳被選中的高分日誌列表，供後續 LLM 分析使用
-    return top_scored_lines_to_index
+    # 4. 回傳被選中的高分日誌列表與其向量，供後續 LLM 分析使用
+    return top_scored_lines_to_index, line_vectors
@@ -1,32 +1,97 @@
 """Heuristic scoring functions used during log preprocessing."""
 
 import logging
-from typing import List
+from typing import List, Tuple
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+try:
+    import ahocorasick
+except ImportError:
+    logger.info("未安裝 pyahocorasick，關鍵字比對將逐一檢查子字串。可執行: pip install pyahocorasick")
+    ahocorasick = None
+
+try:
+    from numba import njit
+except ImportError:
+    logger.info("未安裝 numba，批次評分將使用 NumPy 向量化運算。可執行: pip install numba")
+    njit = None
+
 SUSPICIOUS_KEYWORDS: List[str] = [
     "/etc/passwd", "<script>", " OR ", "%20OR%20", "SELECT ", "UNION ",
     "INSERT ", "CONCAT("
 ]
 COMMON_SCANNER_UAS: List[str] = ["nmap", "sqlmap", "nikto", "curl/", "python-requests"]
 
+# 關鍵字比對使用的小寫常數，於載入時計算一次；掃描器依常見程度排序
+_SUSPICIOUS_LOWER = tuple(k.lower() for k in SUSPICIOUS_KEYWORDS)
+_UAS_LOWER = ("curl/", "python-requests") + tuple(
+    ua.lower() for ua in COMMON_SCANNER_UAS if ua.lower() not in ("curl/", "python-requests")
+)
+_RESP_TIME_TAG = "resp_time:"
+
+def _build_automaton():
+    """將可疑關鍵字與掃描器 UA 編譯成單一 Aho-Corasick 自動機，一次掃描即可取得所有命中"""
+    automaton = ahocorasick.Automaton()
+    for k in _SUSPICIOUS_LOWER:
+        automaton.add_word(k, (False, k))
+    for ua in _UAS_LOWER:
+        automaton.add_word(ua, (True, ua))
+    automaton.make_automaton()
+    return automaton
+
+_AC = _build_automaton() if ahocorasick is not None else None
+
+def _scan_keywords(lp: str) -> Tuple[int, bool]:
+    """
+    掃描已轉小寫的日誌行，回傳 (命中的不同可疑關鍵字數量, 是否命中掃描器 UA)。
+
+    有安裝 pyahocorasick 時以自動機單次掃描，否則退回逐一的子字串檢查。
+    自動機會回報重疊的命中 (例如 "union or 1=1" 中共用空白的 "union " 與 " or ")，
+    與子字串檢查的結果一致；正規表示式的 finditer 不會回報重疊命中，因此不使用。
+    """
+    if _AC is not None:
+        keywords = set()
+        ua_hit = False
+        for _, (is_ua, word) in _AC.iter(lp):
+            if is_ua:
+                ua_hit = True
+            else:
+                keywords.add(word)
+        return len(keywords), ua_hit
+    return sum(k in lp for k in _SUSPICIOUS_LOWER), any(ua in lp for ua in _UAS_LOWER)
+
 def parse_status(line: str) -> int:
-    """從日誌行中解析 HTTP 狀態碼"""
-    try:
-        parts = line.split("\"")
-        if len(parts) > 2:
-            status_part = parts[2].strip().split()[0]
-            return int(status_part)
-    except Exception:
-        pass
+    """
+    從日誌行中解析 HTTP 狀態碼。
+
+    Combined Log Format 的狀態碼固定位於第二個雙引號之後，
+    直接定位並讀取 3 位數字，不需切分整行或走例外處理路徑。
+    """
+    first = line.find('"')
+    if first < 0:
+        return 0
+    second = line.find('"', first + 1)
+    if second < 0:
+        return 0
+    start = second + 1
+    n = len(line)
+    while start < n and line[start] in " \t":
+        start += 1
+    end = start + 3
+    code = line[start:end]
+    if len(code) == 3 and code.isascii() and code.isdigit() and (end == n or line[end] in ' \t"'):
+        return int(code)
     return 0
 
 def response_time(line: str) -> float:
     """從日誌行中解析回應時間"""
-    if "resp_time:" in line:
+    pos = line.find(_RESP_TIME_TAG)
+    if pos >= 0:
         try:
-            val_str = line.split("resp_time:")[1].split()[0].split("\"")[0]
+            val_str = line[pos + len(_RESP_TIME_TAG):].split()[0].split("\"")[0]
             return float(val_str)
         except (ValueError, IndexError):
             pass
@@ -44,11 +109,70 @@ def fast_score(line: str) -> float:
     if response_time(line) > 1.0:
         score += 0.2
 
-    keyword_hits = sum(1 for k in SUSPICIOUS_KEYWORDS if k.lower() in lp)
+    keyword_hits, ua_hit = _scan_keywords(lp)
     if keyword_hits > 0:
         score += min(0.4, keyword_hits * 0.1)
 
-    if any(ua.lower() in lp for ua in COMMON_SCANNER_UAS):
+    if ua_hit:
         score += 0.2
 
     return min(score, 1.0)
+
+def _combine_scores_numpy(status: np.ndarray, rt: np.ndarray, kw_hits: np.ndarray, ua_hit: np.ndarray) -> np.ndarray:
+    """依 fast_score 的規則，以 NumPy 向量化運算組合各項特徵的分數"""
+    scores = np.zeros(status.shape[0], dtype=np.float32)
+    scores += np.where(((status < 200) | (status >= 400)) & (status != 0), 0.4, 0.0).astype(np.float32)
+    scores += np.where(rt > 1.0, 0.2, 0.0).astype(np.float32)
+    scores += np.minimum(0.4, kw_hits * 0.1).astype(np.float32)
+    scores += np.where(ua_hit, 0.2, 0.0).astype(np.float32)
+    return np.minimum(scores, 1.0)
+
+if njit is not None:
+    # 不啟用 parallel=True：fast_score_batch 會在讀檔執行緒池中被多個執行緒同時呼叫，
+    # 從多個執行緒啟動 numba 的平行核心會讓 TBB 工作執行緒在程式結束時卡住；
+    # 每批最多 LMS_SCORE_CHUNK_SIZE 筆，單執行緒的原生迴圈已足夠快
+    @njit(cache=True, fastmath=True)
+    def _combine_scores_jit(status, rt, kw_hits, ua_hit):
+        """與 _combine_scores_numpy 相同的規則，編譯成單一原生迴圈"""
+        out = np.zeros(status.shape[0], dtype=np.float32)
+        for i in range(status.shape[0]):
+            s = 0.0
+            if status[i] != 0 and not (200 <= status[i] < 400):
+                s += 0.4
+            if rt[i] > 1.0:
+                s += 0.2
+            if kw_hits[i] > 0:
+                s += min(0.4, kw_hits[i] * 0.1)
+            if ua_hit[i]:
+                s += 0.2
+            out[i] = min(s, 1.0)
+        return out
+
+    _combine_scores = _combine_scores_jit
+else:
+    _combine_scores = _combine_scores_numpy
+
+def fast_score_batch(lines: List[str]) -> np.ndarray:
+    """
+    一次對多行日誌進行啟發式評分，規則與 ``fast_score`` 相同。
+
+    每行只做一次掃描以擷取特徵，分數的組合則以 NumPy 向量化運算
+    (有安裝 numba 時改用 JIT 編譯的迴圈) 完成，避免逐行呼叫 ``fast_score`` 的直譯器負擔。
+
+    Returns:
+        形狀為 (len(lines),) 的 float32 陣列。
+    """
+    n = len(lines)
+    status = np.zeros(n, dtype=np.int32)
+    rt = np.zeros(n, dtype=np.float32)
+    kw_hits = np.zeros(n, dtype=np.int32)
+    ua_hit = np.zeros(n, dtype=bool)
+
+    # 狀態碼與回應時間直接沿用 fast_score 的解析函式，確保兩條路徑的規則完全一致
+    for i, line in enumerate(lines):
+        status[i] = parse_status(line)
+        rt[i] = response_time(line)
+        # 與 fast_score 相同，計算的是命中的「不同」關鍵字數量
+        kw_hits[i], ua_hit[i] = _scan_keywords(line.lower())
+
+    return _combine_scores(status, rt, kw_hits, ua_hit)
@@ -1,35 +1,69 @@
 """Entry point for processing log files and orchestrating analysis."""
 
+import itertools
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
-from .core.config import settings
+import numpy as np
+
+from .core.config import ensure_dirs, settings
 # 移除 fast_score, embed, VECTOR_DB 的導入，因為它們已被封裝到 indexer 中
-from .data_processing.indexer import update_vector_index # <--- 新增導入
+from .data_processing.indexer import index_candidates, score_candidates
 from .rag_pipeline.llm import llm_analyse, LLM_ENABLED
-from .utils.file_tracker import tail_since
+from .utils.file_tracker import iter_since, maybe_save_log_state
 
 logger = logging.getLogger(__name__)
 
 
+class _LazyJSON:
+    """
+    延遲序列化的包裝物件，僅在日誌記錄真正被格式化輸出時才呼叫 json.dumps。
+
+    同一筆記錄會被每個 handler 各格式化一次，因此序列化結果會被保留重複使用。
+    """
+    __slots__ = ("obj", "_text")
+
+    def __init__(self, obj: Any):
+        self.obj = obj
+        self._text: Optional[str] = None
+
+    def __str__(self) -> str:
+        if self._text is None:
+            self._text = json.dumps(self.obj, ensure_ascii=False)
+        return self._text
+
+
 def process_and_analyze_logs(log_paths: List[Path]) -> List[Dict[str, Any]]:
     """
     主處理與分析流程的協調器。
     """
-    # 1. 讀取增量日誌
-    all_new_lines: List[str] = []
-    for p in log_paths:
-        all_new_lines.extend(tail_since(p))
+    ensure_dirs()
+
+    # 1. 串流讀取增量日誌並評分 (檔案 I/O 與解壓縮會釋放 GIL，多個檔案可並行處理)
+    #    每個檔案只保留分數大於 0 的候選行，不需要把所有新日誌同時載入記憶體
+    if not log_paths:
+        logger.info("無新增日誌需要處理。")
+        return []
+
+    max_workers = max(1, min(settings.LMS_MAX_READ_WORKERS, len(log_paths)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        per_file = list(executor.map(lambda p: score_candidates(iter_since(p)), log_paths))
 
-    if not all_new_lines:
+    total_lines = sum(total for _, _, total in per_file)
+    if not total_lines:
         logger.info("無新增日誌需要處理。")
         return []
 
-    # 2. 對新日誌進行索引更新，並獲取需要深度分析的日誌列表 (***這是主要變更***)
-    top_scored_lines_with_scores = update_vector_index(all_new_lines)
+    scores = np.concatenate([file_scores for file_scores, _, _ in per_file])
+    candidates = list(itertools.chain.from_iterable(lines for _, lines, _ in per_file))
+    logger.info(f"已對 {total_lines} 行新日誌進行啟發式評分，其中 {len(candidates)} 行分數大於 0。")
+
+    # 2. 對候選日誌進行索引更新，並獲取需要深度分析的日誌列表
+    top_scored_lines_with_scores, line_vectors = index_candidates(scores, candidates)
 
     if not top_scored_lines_with_scores:
         logger.info("經過濾與索引後，無日誌需要進一步的 LLM 分析。")
@@ -38,7 +72,7 @@ def process_and_analyze_logs(log_paths: List[Path]) -> List[Dict[str, Any]]:
     top_lines_content = [line for _, line in top_scored_lines_with_scores]
 
     # 3. LLM 分析
-    llm_analyses = llm_analyse(top_lines_content) if LLM_ENABLED else [None] * len(top_lines_content)
+    llm_analyses = llm_analyse(top_lines_content, line_vectors) if LLM_ENABLED else [None] * len(top_lines_content)
 
     # 4. 彙整結果 (此部分不變)
     exported_results: List[Dict[str, Any]] = []
@@ -68,12 +102,12 @@ def process_and_analyze_logs(log_paths: List[Path]) -> List[Dict[str, Any]]:
         else:
             log_level = logging.INFO
 
-        log_message = (
-            f"日誌: {original_line}\n"
-            f"  ├─ 啟發式評分: {fast_s:.2f}\n"
-            f"  └─ LLM 分析: {json.dumps(analysis_result, ensure_ascii=False)}"
-        )
-        logger.log(log_level, log_message)
+        if logger.isEnabledFor(log_level):
+            logger.log(
+                log_level,
+                "日誌: %s\n  ├─ 啟發式評分: %.2f\n  └─ LLM 分析: %s",
+                original_line, fast_s, _LazyJSON(analysis_result),
+            )
 
     logger.info("=" * (64))
 
@@ -82,4 +116,6 @@ def process_and_analyze_logs(log_paths: List[Path]) -> List[Dict[str, Any]]:
     else:
         logger.info("分析完成，未發現明確的攻擊警示。")
 
+    # 長時間執行時定期保存讀取進度；程式結束前仍會完整儲存一次
+    maybe_save_log_state()
     return exported_results
@@ -1,30 +1,62 @@
 """Simple in-memory LRU cache used by the LLM pipeline."""
 
+import itertools
 import logging
-from collections import OrderedDict
-from typing import Any, Optional
+from typing import Any, Dict, Iterable, Optional, Tuple
 from ..core.config import settings
 
 logger = logging.getLogger(__name__)
 
-class LRUCache(OrderedDict):
-    """簡單的 LRU 快取實現"""
+_MISSING = object()
+
+class LRUCache:
+    """
+    簡單的 LRU 快取實現。
+
+    Python 3.7 之後的 dict 會保留插入順序，命中時將鍵值取出再重新插入即可移到最新位置，
+    省去 OrderedDict 的鏈結串列維護成本；最舊的項目永遠位於 dict 的開頭。
+    """
+    __slots__ = ("capacity", "_data")
+
     def __init__(self, capacity: int):
-        super().__init__()
         self.capacity = capacity
+        self._data: Dict[Any, Any] = {}
         logger.info(f"LRU 快取已初始化，容量為 {capacity}。")
 
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._data
+
     def get(self, key: Any) -> Optional[Any]:
-        if key in self:
-            self.move_to_end(key)
-            return self[key]
-        return None
+        data = self._data
+        value = data.pop(key, _MISSING)
+        if value is _MISSING:
+            return None
+        data[key] = value
+        return value
 
     def put(self, key: Any, value: Any):
-        if key in self:
-            self.move_to_end(key)
-        self[key] = value
-        if len(self) > self.capacity:
-            self.popitem(last=False)
+        data = self._data
+        data.pop(key, None)
+        data[key] = value
+        if len(data) > self.capacity:
+            del data[next(iter(data))]
+
+    def put_many(self, pairs: Iterable[Tuple[Any, Any]]):
+        """
+        一次寫入多筆鍵值，結果與依序呼叫 put 相同。
+
+        超出容量的舊項目在全部寫入後才一次淘汰，省去每筆都檢查容量的負擔。
+        """
+        data = self._data
+        for key, value in pairs:
+            data.pop(key, None)
+            data[key] = value
+        overflow = len(data) - self.capacity
+        if overflow > 0:
+            for key in list(itertools.islice(data, overflow)):
+                del data[key]
 
 CACHE = LRUCache(settings.LMS_CACHE_SIZE)
@@ -2,49 +2,76 @@
 
 import hashlib
 import logging
-import os
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional
+
+import numpy as np
 
 from ..core.config import settings
 
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
 logger = logging.getLogger(__name__)
 
-try:
-    from sentence_transformers import SentenceTransformer
-    SENTENCE_MODEL: Optional[SentenceTransformer] = SentenceTransformer(settings.EMBEDDING_MODEL_NAME)
-    if SENTENCE_MODEL:
+# SentenceTransformer 模型在第一次需要嵌入時才載入，避免 import 本模組就付出數秒的載入時間與大量記憶體
+_MODEL: Optional["SentenceTransformer"] = None
+_MODEL_LOADED = False
+
+
+def get_sentence_model() -> Optional["SentenceTransformer"]:
+    """取得 SentenceTransformer 模型；首次呼叫時載入，失敗則回傳 None 並改用 SHA256 偽向量。"""
+    global _MODEL, _MODEL_LOADED
+    if _MODEL_LOADED:
+        return _MODEL
+    _MODEL_LOADED = True
+    try:
+        from sentence_transformers import SentenceTransformer
+        _MODEL = SentenceTransformer(settings.EMBEDDING_MODEL_NAME)
         # 動態更新 EMBED_DIM
-        settings.EMBED_DIM = SENTENCE_MODEL.get_sentence_embedding_dimension() or 384
+        settings.EMBED_DIM = _MODEL.get_sentence_embedding_dimension() or 384
         logger.info(f"成功載入 SentenceTransformer 模型: {settings.EMBEDDING_MODEL_NAME} (維度: {settings.EMBED_DIM})")
-except ImportError:
-    logger.warning("[WARN] 未安裝 sentence-transformers，將使用 SHA256 偽向量。建議安裝: pip install sentence-transformers")
-    SENTENCE_MODEL = None
-except Exception as e:
-    logger.error(f"載入 SentenceTransformer 模型失敗: {e}。將使用 SHA256 偽向量。")
-    SENTENCE_MODEL = None
+    except ImportError:
+        logger.warning("[WARN] 未安裝 sentence-transformers，將使用 SHA256 偽向量。建議安裝: pip install sentence-transformers")
+        _MODEL = None
+    except Exception as e:
+        logger.error(f"載入 SentenceTransformer 模型失敗: {e}。將使用 SHA256 偽向量。")
+        _MODEL = None
+    return _MODEL
+
 
+def embed_lines(lines: List[str]) -> np.ndarray:
+    """
+    一次性將多行文字轉換為嵌入向量。
 
-def embed_lines(lines: List[str]) -> List[List[float]]:
-    """一次性將多行文字轉換為嵌入向量。"""
+    回傳形狀為 (len(lines), EMBED_DIM) 的 float32 陣列，可直接交給 FAISS 使用。
+    """
     if not lines:
-        return []
+        return np.empty((0, settings.EMBED_DIM), dtype=np.float32)
 
-    if SENTENCE_MODEL:
-        embeddings = SENTENCE_MODEL.encode(lines, convert_to_numpy=True)
-        return [emb.tolist() for emb in embeddings]
+    model = get_sentence_model()
+    if model:
+        embeddings = model.encode(
+            lines,
+            batch_size=min(64, len(lines)),
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+        return embeddings.astype(np.float32, copy=False)
 
     logger.warning("正在使用 SHA-256 偽向量，這不適用於生產環境！")
-    vectors: List[List[float]] = []
-    for text in lines:
-        digest = hashlib.sha256(text.encode('utf-8', 'replace')).digest()
-        vec_template = list(digest)
-        vec = []
-        while len(vec) < settings.EMBED_DIM:
-            vec.extend(vec_template)
-        vectors.append([v / 255.0 for v in vec[:settings.EMBED_DIM]])
+    digest_size = hashlib.sha256().digest_size
+    digests = np.frombuffer(
+        b"".join(hashlib.sha256(text.encode('utf-8', 'replace')).digest() for text in lines),
+        dtype=np.uint8,
+    ).reshape(len(lines), digest_size)
+    reps = -(-settings.EMBED_DIM // digest_size)
+    vectors = np.tile(digests, (1, reps))[:, :settings.EMBED_DIM].astype(np.float32)
+    # 與模型輸出一致，正規化為單位長度，讓 L2 距離可換算為餘弦相似度
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
     return vectors
 
 
 def embed(text: str) -> List[float]:
     """兼容單行輸入的舊 API。"""
-    return embed_lines([text])[0]
+    return embed_lines([text])[0].tolist()
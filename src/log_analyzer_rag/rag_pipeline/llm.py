@@ -2,15 +2,30 @@
 
 import json
 import logging
+import time
 import urllib.request
-from datetime import datetime, timedelta, timezone
-from typing import List, Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, List, Optional, Dict, Any, Tuple
+
+import numpy as np
 
 from ..core.config import settings
 from .cache import CACHE
+from .embedding import embed_lines
+from .vector_store import VECTOR_DB
 
 logger = logging.getLogger(__name__)
 
+# 費用統計的時間窗口長度 (奈秒，整數比較不需浮點運算)
+_COST_WINDOW_NS = 3_600_000_000_000
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    logger.info("未安裝 orjson，LLM 回應將以標準 json 模組解析。可執行: pip install orjson")
+    _loads = json.loads
+
 
 class LLMCostTracker:
     def __init__(self):
@@ -20,22 +35,24 @@ class LLMCostTracker:
         self.total_in_tokens = 0
         self.total_out_tokens = 0
         self.total_cost = 0.0
-        self._window_start_time = datetime.now(timezone.utc)
+        # 每個 token 的價格，於初始化時換算一次
+        self._in_price = settings.LMS_PRICE_IN_PER_1K_TOKENS * 1e-3
+        self._out_price = settings.LMS_PRICE_OUT_PER_1K_TOKENS * 1e-3
+        # 以單調時鐘計算窗口，不受系統時間調整影響，也不必每次建立 datetime 物件
+        self._window_start_ns = time.monotonic_ns()
 
     def add_usage(self, in_tok: int, out_tok: int):
         self.in_tokens_hourly += in_tok
         self.out_tokens_hourly += out_tok
-        current_cost = (
-            in_tok / 1000 * settings.LMS_PRICE_IN_PER_1K_TOKENS
-            + out_tok / 1000 * settings.LMS_PRICE_OUT_PER_1K_TOKENS
-        )
+        current_cost = in_tok * self._in_price + out_tok * self._out_price
         self.cost_hourly += current_cost
         self.total_in_tokens += in_tok
         self.total_out_tokens += out_tok
         self.total_cost += current_cost
 
     def reset_if_window_passed(self):
-        if datetime.now(timezone.utc) - self._window_start_time > timedelta(hours=1):
+        now = time.monotonic_ns()
+        if now - self._window_start_ns > _COST_WINDOW_NS:
             logger.info(
                 "LLM 每小時費用窗口重置。上一小時: "
                 f"Input Tokens: {self.in_tokens_hourly}, "
@@ -45,7 +62,7 @@ class LLMCostTracker:
             self.in_tokens_hourly = 0
             self.out_tokens_hourly = 0
             self.cost_hourly = 0.0
-            self._window_start_time = datetime.now(timezone.utc)
+            self._window_start_ns = now
 
     def get_hourly_cost(self) -> float:
         return self.cost_hourly
@@ -60,8 +77,9 @@ class LLMCostTracker:
 
 COST_TRACKER = LLMCostTracker()
 LLM_ENABLED = bool(settings.OLLAMA_API_URL)
-PROMPT_TEMPLATE_STR = """
-System: 你是一位資安分析助手。請仔細評估以下 Web 伺服器日誌條目，判斷其是否顯示任何潛在的攻擊行為、可疑活動或明顯的錯誤。
+# 固定的系統指示只透過 Ollama 的 "system" 欄位傳送；每個請求的 prompt 只包含日誌本身。
+# 搭配 keep_alive 讓模型常駐，Ollama 可重用相同系統前綴的 KV cache，不必每次重新處理整段指示。
+SYSTEM_PROMPT = """你是一位資安分析助手。請仔細評估以下 Web 伺服器日誌條目，判斷其是否顯示任何潛在的攻擊行為、可疑活動或明顯的錯誤。
 你的分析應著重於識別模式，例如 SQL 注入、跨站腳本(XSS)、目錄遍歷、機器人掃描、暴力破解嘗試、異常的 User-Agent、非預期的 HTTP 狀態碼、過長的請求或回應時間等。
 
 請根據你的分析，提供一個 JSON 格式的回應，包含以下欄位：
@@ -69,66 +87,238 @@ System: 你是一位資安分析助手。請仔細評估以下 Web 伺服器日
 - "attack_type": string (如果 is_attack 為 true，請描述攻擊類型，例如 "SQL Injection", "XSS", "Path Traversal", "Bot Scanning", "Error Exploitation", "Unknown Anomaly"。如果 is_attack 為 false，則為 "N/A")
 - "reason": string (簡要解釋你判斷的理由，即使 is_attack 為 false 也請說明為何正常或僅為低風險錯誤)
 - "severity": string (攻擊的嚴重程度，例如 "High", "Medium", "Low"。如果 is_attack 為 false，則為 "None")
-
-Log Entry:
+"""
+USER_PROMPT_TEMPLATE = """Log Entry:
 {log_entry}
 
 JSON Output:
 """
+# 模板只有一個 {log_entry} 佔位符，預先切成前後兩段，組字串時直接串接
+_PROMPT_PREFIX, _PROMPT_SUFFIX = USER_PROMPT_TEMPLATE.split("{log_entry}")
 
 
-def _query_ollama_batch(prompts: List[str]) -> List[str]:
-    """一次性向 Ollama 發送多個 prompt 並取得回應列表。"""
-    payload = json.dumps({"model": settings.LLM_MODEL_NAME, "prompt": prompts, "stream": False}).encode("utf-8")
-def llm_analyse(lines: List[str]) -> List[Optional[Dict[str, Any]]]:
-    if not LLM_ENABLED:
-        logger.warning("LLM 未啟用，跳過分析。")
-        return [None] * len(lines)
+def _render(log_entry: str) -> str:
+    """將日誌填入使用者模板。"""
+    return _PROMPT_PREFIX + log_entry + _PROMPT_SUFFIX
 
-    results: List[Optional[Dict[str, Any]]] = [None] * len(lines)
-    original_indices_to_query: List[int] = []
-    batch_prompts: List[str] = []
 
-    for idx, line_content in enumerate(lines):
-        cached_result = CACHE.get(line_content)
-        if cached_result is not None:
-            results[idx] = cached_result
+def _estimate_tokens(text: str) -> int:
+    """以每 4 個字元約 1 個 token 粗估長度，僅在伺服器未回報實際 token 數時使用。"""
+    return len(text) // 4
+
+
+# 系統指示與使用者模板 (不含 {log_entry}) 的固定 token 估計值，於載入時計算一次
+_BASE_PROMPT_TOKENS = _estimate_tokens(SYSTEM_PROMPT) + _estimate_tokens(_PROMPT_PREFIX + _PROMPT_SUFFIX)
+
+
+def _post_generate(body: Dict[str, Any]) -> Dict[str, Any]:
+    """送出一個非串流的 /api/generate 請求並回傳解析後的回應。"""
+    payload = json.dumps(body).encode("utf-8")
+    request = urllib.request.Request(
+        settings.OLLAMA_API_URL, data=payload, headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request, timeout=settings.LLM_REQUEST_TIMEOUT_S) as resp:
+        return _loads(resp.read())
+
+
+# 本次執行是否已預熱過模型 (無論成功與否只嘗試一次)
+_WARMED_UP = False
+
+
+def _warm_up_llm():
+    """
+    在第一批並行請求前，先以系統指示送出一個只產生 1 個 token 的請求。
+
+    讓 Ollama 預先載入模型並計算系統前綴的 KV cache，之後的請求只需處理日誌本身；
+    否則第一批並行請求會同時等待模型載入、各自重新處理整段系統指示。
+    """
+    global _WARMED_UP
+    if _WARMED_UP or not settings.LLM_WARMUP:
+        return
+    _WARMED_UP = True
+    try:
+        body = _post_generate({
+            "model": settings.LLM_MODEL_NAME,
+            "system": SYSTEM_PROMPT,
+            "prompt": _render(""),
+            "stream": False,
+            "keep_alive": settings.LLM_KEEP_ALIVE,
+            "options": {"num_predict": 1},
+        })
+        COST_TRACKER.add_usage(body.get("prompt_eval_count") or 0, body.get("eval_count") or 0)
+        logger.info(f"LLM 模型 {settings.LLM_MODEL_NAME} 已預熱並快取系統指示。")
+    except Exception as e:
+        logger.warning(f"LLM 預熱失敗，將直接送出分析請求: {e}")
+
+
+def _query_ollama(log_entry: str) -> Tuple[str, int, int]:
+    """
+    請 Ollama 分析單筆日誌 (系統指示另以 system 欄位傳送)。
+
+    Returns:
+        (模型輸出文字, 輸入 token 數, 輸出 token 數)。token 數取自 Ollama 回報的
+        prompt_eval_count / eval_count，缺少時才以字元數估算。
+    """
+    body = _post_generate({
+        "model": settings.LLM_MODEL_NAME,
+        "system": SYSTEM_PROMPT,
+        "prompt": _render(log_entry),
+        "format": "json",
+        "stream": False,
+        "keep_alive": settings.LLM_KEEP_ALIVE,
+    })
+    text = body.get("response", "")
+    in_tok = body.get("prompt_eval_count")
+    out_tok = body.get("eval_count")
+    return (
+        text,
+        in_tok if in_tok is not None else _BASE_PROMPT_TOKENS + _estimate_tokens(log_entry),
+        out_tok if out_tok is not None else _estimate_tokens(text),
+    )
+
+
+def _query_ollama_safe(log_entry: str) -> Tuple[str, int, int]:
+    """呼叫 _query_ollama；失敗時回傳標記為 LLM Error 的 JSON，讓其他請求不受影響。"""
+    try:
+        return _query_ollama(log_entry)
+    except Exception as e:
+        logger.error(f"呼叫 LLM 失敗: {e}")
+        error_text = json.dumps({"is_attack": True, "attack_type": "LLM Error", "reason": str(e), "severity": "Medium"})
+        return error_text, 0, 0
+
+
+def _query_ollama_batch(log_entries: List[str]) -> Iterator[Tuple[int, Tuple[str, int, int]]]:
+    """
+    並行請 Ollama 分析多筆日誌，依完成順序產生 (輸入索引, (回應, 輸入 token, 輸出 token))。
+
+    各請求彼此獨立，以最多 LLM_MAX_CONCURRENCY 個執行緒同時送出，讓網路往返與推論時間重疊；
+    結果一完成就交給呼叫端處理，解析 JSON 的時間可與仍在進行中的請求重疊。
+    """
+    _warm_up_llm()
+    max_workers = min(settings.LLM_MAX_CONCURRENCY, len(log_entries))
+    if max_workers <= 1:
+        for i, entry in enumerate(log_entries):
+            yield i, _query_ollama_safe(entry)
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_query_ollama_safe, entry): i for i, entry in enumerate(log_entries)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def _semantic_cache_lookup(
+    pending: Dict[str, List[int]],
+    results: List[Optional[Dict[str, Any]]],
+    line_vectors: Dict[str, Tuple[int, np.ndarray]],
+) -> Dict[str, np.ndarray]:
+    """
+    對精確快取未命中的日誌查詢語意快取。
+
+    命中者 (與已分析日誌的餘弦相似度達 SEMANTIC_CACHE_THRESHOLD) 直接沿用既有分析結果、
+    寫入 results 與精確快取，並自 pending 移除。已在 line_vectors 中的日誌沿用其向量，
+    只有其餘日誌需要產生嵌入。
+
+    Returns:
+        仍未命中的日誌及其嵌入向量，供 LLM 分析完成後寫回語意快取。
+    """
+    if not (settings.SEMANTIC_CACHE_ENABLED and VECTOR_DB.enabled):
+        return {}
+    unique_lines = list(pending)
+    to_embed = [line for line in unique_lines if line not in line_vectors]
+    try:
+        new_embeddings = dict(zip(to_embed, embed_lines(to_embed))) if to_embed else {}
+    except Exception as e:
+        logger.error(f"語意快取產生嵌入向量失敗: {e}")
+        return {}
+    embeddings = np.stack([
+        line_vectors[line][1] if line in line_vectors else new_embeddings[line] for line in unique_lines
+    ])
+
+    misses: Dict[str, np.ndarray] = {}
+    hit_pairs: List[Tuple[str, Dict[str, Any]]] = []
+    hits_by_line = VECTOR_DB.search_with_payload_batch(embeddings)
+    for line_content, emb, hit in zip(unique_lines, embeddings, hits_by_line):
+        if hit is not None and hit[0] >= settings.SEMANTIC_CACHE_THRESHOLD:
+            analysis_result = hit[1]
+            for original_idx in pending.pop(line_content):
+                results[original_idx] = analysis_result
+            hit_pairs.append((line_content, analysis_result))
         else:
-            original_indices_to_query.append(idx)
-            prompt = PROMPT_TEMPLATE_STR.replace("{log_entry}", line_content)
-            batch_prompts.append(prompt)
+            misses[line_content] = emb
+    if hit_pairs:
+        CACHE.put_many(hit_pairs)
+        logger.info(f"語意快取命中 {len(hit_pairs)} 筆日誌，略過 LLM 分析。")
+    return misses
+
+
+def _semantic_cache_store(
+    line_vectors: Dict[str, Tuple[int, np.ndarray]],
+    embeddings: Dict[str, np.ndarray],
+    analyses: Dict[str, Dict[str, Any]],
+):
+    """
+    將分析結果寫入語意快取；LLM 錯誤的結果不寫入。
+
+    已由 indexer 加入 FAISS 的日誌直接在該向量附上分析結果，其餘日誌才以查詢時產生的向量新增，
+    同一行日誌在索引中只會有一個向量。
+    """
+    if not (settings.SEMANTIC_CACHE_ENABLED and VECTOR_DB.enabled):
+        return
+    known_ids: List[int] = []
+    known_payloads: List[Dict[str, Any]] = []
+    new_lines: List[str] = []
+    for line, analysis in analyses.items():
+        if analysis.get("attack_type") == "LLM Error":
+            continue
+        if line in line_vectors:
+            known_ids.append(line_vectors[line][0])
+            known_payloads.append(analysis)
+        elif line in embeddings:
+            new_lines.append(line)
+    try:
+        if known_ids:
+            VECTOR_DB.set_payloads(known_ids, known_payloads)
+        if new_lines:
+            VECTOR_DB.add(np.stack([embeddings[k] for k in new_lines]), payloads=[analyses[k] for k in new_lines])
+    except Exception as e:
+        logger.error(f"寫入語意快取失敗: {e}")
 
-    if not batch_prompts:
-        logger.info("所有待分析日誌均命中快取。")
-        return results
 
+def _analyse_pending(
+    pending: Dict[str, List[int]], results: List[Optional[Dict[str, Any]]]
+) -> Dict[str, Dict[str, Any]]:
+    """
+    以 LLM 分析所有快取未命中的日誌，將結果回填 results 並寫入精確快取。
+
+    Returns:
+        日誌 -> 新的分析結果；已達每小時費用上限時不送出請求並回傳空字典。
+    """
     COST_TRACKER.reset_if_window_passed()
     if COST_TRACKER.get_hourly_cost() >= settings.LMS_MAX_HOURLY_COST_USD:
         logger.warning(
             f"已達每小時 LLM 費用上限 (${settings.LMS_MAX_HOURLY_COST_USD:.2f})，本輪剩餘日誌將不進行分析。"
         )
-        for i_orig in original_indices_to_query:
-            results[i_orig] = {
-                "is_attack": False,
-                "attack_type": "N/A",
-                "reason": "Budget limit reached, not analyzed.",
-                "severity": "None",
-            }
-        return results
+        for indices in pending.values():
+            for i_orig in indices:
+                results[i_orig] = {
+                    "is_attack": False,
+                    "attack_type": "N/A",
+                    "reason": "Budget limit reached, not analyzed.",
+                    "severity": "None",
+                }
+        return {}
 
-    logger.info(f"準備呼叫 LLM 分析 {len(batch_prompts)} 筆日誌。")
+    unique_lines = list(pending)
+    logger.info(f"準備呼叫 LLM 分析 {len(unique_lines)} 筆日誌 (原始 {sum(map(len, pending.values()))} 筆，已合併重複內容)。")
 
-    total_in_tokens_batch = sum(len(p.split()) for p in batch_prompts)
+    total_in_tokens_batch = 0
     total_out_tokens_batch = 0
-    try:
-        responses = _query_ollama_batch(batch_prompts)
-    except Exception as e:
-        logger.error(f"批次呼叫 LLM 失敗: {e}")
-        responses = [json.dumps({"is_attack": True, "attack_type": "LLM Error", "reason": str(e), "severity": "Medium"})] * len(batch_prompts)
+    new_analyses: Dict[str, Dict[str, Any]] = {}
 
-    for i, response_text in enumerate(responses):
+    for i, (response_text, in_tok, out_tok) in _query_ollama_batch(unique_lines):
+        line_content = unique_lines[i]
         try:
-            analysis_result = json.loads(response_text)
+            analysis_result = _loads(response_text)
         except Exception:
             analysis_result = {
                 "is_attack": True,
@@ -136,18 +326,66 @@ def llm_analyse(lines: List[str]) -> List[Optional[Dict[str, Any]]]:
                 "reason": "Invalid JSON",
                 "severity": "Medium",
             }
-        original_idx = original_indices_to_query[i]
-        results[original_idx] = analysis_result
-        CACHE.put(lines[original_idx], analysis_result)
-        out_tok = len(response_text.split())
+        for original_idx in pending[line_content]:
+            results[original_idx] = analysis_result
+        new_analyses[line_content] = analysis_result
+        total_in_tokens_batch += in_tok
         total_out_tokens_batch += out_tok
+    CACHE.put_many(new_analyses.items())
     COST_TRACKER.add_usage(total_in_tokens_batch, total_out_tokens_batch)
     logger.info(
-        f"LLM 呼叫完成。Input tokens (approx): {total_in_tokens_batch}, Output tokens (approx): {total_out_tokens_batch}"
+        f"LLM 呼叫完成。Input tokens: {total_in_tokens_batch}, Output tokens: {total_out_tokens_batch}"
     )
 
     if COST_TRACKER.get_hourly_cost() >= settings.LMS_MAX_HOURLY_COST_USD:
         logger.warning(
             f"LLM 處理後已達或超過每小時費用上限 (${settings.LMS_MAX_HOURLY_COST_USD:.2f})。"
         )
+    return new_analyses
+
+
+def llm_analyse(
+    lines: List[str], line_vectors: Optional[Dict[str, Tuple[int, np.ndarray]]] = None
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    分析日誌並回傳與 lines 一一對應的結果，依序經過精確快取、語意快取與 LLM。
+
+    Args:
+        lines: 待分析的日誌。
+        line_vectors: 可選，``index_candidates`` 已加入 FAISS 的日誌 -> (向量 id, 嵌入向量)。
+            語意快取沿用這些向量、並把分析結果附加到同一個向量上，不再重複嵌入與新增。
+    """
+    if not LLM_ENABLED:
+        logger.warning("LLM 未啟用，跳過分析。")
+        return [None] * len(lines)
+    line_vectors = line_vectors or {}
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(lines)
+    # 先依內容分組，相同內容只查詢一次快取、只送出一次 LLM 請求，結果再回填到所有對應位置
+    groups: Dict[str, List[int]] = {}
+    for idx, line_content in enumerate(lines):
+        groups.setdefault(line_content, []).append(idx)
+
+    pending: Dict[str, List[int]] = {}
+    for line_content, indices in groups.items():
+        cached_result = CACHE.get(line_content)
+        if cached_result is not None:
+            for idx in indices:
+                results[idx] = cached_result
+        else:
+            pending[line_content] = indices
+
+    miss_embeddings = _semantic_cache_lookup(pending, results, line_vectors) if pending else {}
+    if pending:
+        new_analyses = _analyse_pending(pending, results)
+    else:
+        logger.info("所有待分析日誌均命中快取。")
+        new_analyses = {}
+    # 快取命中與 LLM 新分析的結果都寫回語意快取；因費用上限而未分析的日誌 (仍在 pending 且無新結果) 除外
+    analyses = {
+        line: results[indices[0]]
+        for line, indices in groups.items()
+        if line not in pending or line in new_analyses
+    }
+    _semantic_cache_store(line_vectors, miss_embeddings, analyses)
     return results
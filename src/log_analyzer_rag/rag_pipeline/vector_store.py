@@ -1,8 +1,10 @@
 """FAISS based vector store helper classes."""
 
+import json
 import logging
+import os
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Any, Dict, List, Tuple, Optional, Union
 
 import numpy as np
 from ..core.config import settings
@@ -15,48 +17,370 @@ except ImportError:
     logger.warning("[WARN] 未安裝 faiss-cpu，向量搜尋功能停用。請執行: pip install faiss-cpu")
     faiss = None
 
+if faiss is not None:
+    # 預設 OpenMP 執行緒數等於邏輯核心數，在超執行緒主機上會互相搶用同一個實體核心的運算單元；
+    # 未指定 FAISS_NUM_THREADS 時只在操作者沒有自行設定 OMP_NUM_THREADS 的情況下改用一半的核心數
+    _num_threads = settings.FAISS_NUM_THREADS
+    if not _num_threads and not os.environ.get("OMP_NUM_THREADS"):
+        _num_threads = max(1, (os.cpu_count() or 2) // 2)
+    if _num_threads:
+        faiss.omp_set_num_threads(_num_threads)
+        logger.info(f"FAISS OpenMP 執行緒數設定為 {_num_threads}。")
+    else:
+        logger.info(f"FAISS 沿用 OMP_NUM_THREADS={os.environ['OMP_NUM_THREADS']}。")
+
 class VectorIndex:
-    """封裝 FAISS Index 的簡易類別，包含自動載入 / 保存。"""
-    def __init__(self, path: Path, dimension: int):
+    """
+    封裝 FAISS Index 的簡易類別，包含自動載入 / 保存。
+
+    嵌入模型改為延遲載入後，向量維度要到第一次產生嵌入時才確定，
+    因此若磁碟上沒有既有索引，會在第一次 add() 時依向量維度建立新索引。
+
+    所有向量在新增與查詢前都會正規化為單位長度，此時 L2 距離與餘弦相似度一一對應
+    (cos = 1 - d / 2)，因此索引維持 L2 度量即可等同於內積搜尋。
+
+    每個向量可以附帶一份 payload (例如 LLM 的分析結果)，以 FAISS id 為鍵
+    另存於索引旁的 JSON 檔，供語意快取查詢使用。
+
+    需要訓練的索引 (IVFPQ / 8-bit 量化) 在累積到足夠的訓練樣本前無法新增向量，
+    這段期間的向量暫存於記憶體，儲存時寫入索引旁的 .pending.npy，下次執行繼續累積。
+    """
+    def __init__(self, path: Path, dimension: Optional[int] = None):
         self.path = path
+        self.payload_path = path.with_suffix(".payloads.json")
+        self.pending_path = path.with_suffix(".pending.npy")
         self.dimension = dimension
         self.index: Optional[faiss.Index] = None
+        self.payloads: Dict[int, Dict[str, Any]] = {}
+        # 尚未寫入 FAISS 的向量，累積到 FAISS_ADD_FLUSH 筆再一次新增；其 id 在 add() 時即已確定
+        self._pending: List[np.ndarray] = []
+        self._pending_count = 0
+        # 需要訓練的索引開始訓練前所需的最少向量數 (依索引類型於 _create_index 中調整)
+        self._train_min = settings.FAISS_TRAIN_MIN_VECTORS
+        # 索引自上次儲存後是否有變動；沒有變動時 save() 不重寫檔案
+        self._dirty = False
         self._load()
 
+    @property
+    def enabled(self) -> bool:
+        """FAISS 是否可用 (索引本身可能尚未建立)。"""
+        return faiss is not None
+
+    @property
+    def ntotal(self) -> int:
+        """已新增的向量總數，包含仍在暫存區 (尚未寫入 FAISS) 者。"""
+        return (self.index.ntotal if self.index is not None else 0) + self._pending_count
+
     def _load(self):
         if faiss is None:
             return
         if self.path.exists():
             try:
                 self.index = faiss.read_index(str(self.path))
+                self.dimension = self.index.d
                 logger.info(f"從 {self.path} 載入 FAISS 索引，共 {self.index.ntotal if self.index else 0} 個向量。")
             except Exception as e:
                 logger.error(f"讀取 FAISS 索引失敗: {e}。將建立新索引。")
-                self.index = faiss.IndexFlatL2(self.dimension)
+        elif not self.pending_path.exists():
+            logger.info("未找到 FAISS 索引檔，將於第一次新增向量時建立新的 L2 索引。")
+        if self.index is None and self.dimension:
+            self._create_index(self.dimension)
+        self._load_pending()
+        if self.index is not None:
+            self._load_payloads()
+
+    def _load_pending(self):
+        """載入上次執行時因索引尚未訓練而暫存的向量。"""
+        if not self.pending_path.exists():
+            return
+        try:
+            vectors = np.load(self.pending_path)
+        except Exception as e:
+            logger.error(f"讀取暫存向量檔 {self.pending_path} 失敗: {e}")
+            return
+        if self.index is None:
+            self._create_index(vectors.shape[1])
+        elif vectors.shape[1] != self.index.d:
+            logger.error(f"暫存向量維度 {vectors.shape[1]} 與 FAISS 索引維度 {self.index.d} 不符，略過載入。")
+            return
+        self._pending = [np.ascontiguousarray(vectors, dtype=np.float32)]
+        self._pending_count = len(vectors)
+        logger.info(f"從 {self.pending_path} 載入 {self._pending_count} 個尚未寫入索引的暫存向量。")
+
+    def _load_payloads(self):
+        if not self.payload_path.exists():
+            return
+        try:
+            raw = json.loads(self.payload_path.read_text(encoding="utf-8"))
+            self.payloads = {int(k): v for k, v in raw.items()}
+            logger.info(f"從 {self.payload_path} 載入 {len(self.payloads)} 筆向量 payload。")
+        except Exception as e:
+            logger.error(f"讀取向量 payload 檔 {self.payload_path} 失敗: {e}。語意快取將從空白開始。")
+            self.payloads = {}
+
+    def _create_index(self, dimension: int):
+        """依 FAISS_INDEX_TYPE 建立新索引 (flat / hnsw / ivfpq)。"""
+        self.dimension = dimension
+        index_type = settings.FAISS_INDEX_TYPE.lower()
+        if index_type == "hnsw":
+            # HNSW 圖索引不需訓練，查詢成本約為 log(N)
+            logger.info(f"建立新的 HNSW L2 索引 (維度: {dimension}, M: 32)。")
+            self.index = faiss.IndexHNSWFlat(dimension, 32)
+            self.index.hnsw.efConstruction = 200
+        elif index_type == "ivfpq":
+            # 每個子向量 4 維、以 8 bits 編碼，每個向量只佔約 dimension / 4 bytes；m 必須整除維度
+            m = max(1, dimension // 4)
+            while dimension % m:
+                m -= 1
+            nlist = settings.FAISS_IVF_NLIST
+            logger.info(f"建立新的 IVFPQ L2 索引 (維度: {dimension}, nlist: {nlist}, m: {m})。")
+            quantizer = faiss.IndexFlatL2(dimension)
+            self.index = faiss.IndexIVFPQ(quantizer, dimension, nlist, m, 8)
+            # k-means 需要至少 nlist 個樣本，8-bit 乘積量化的每個子空間需要至少 256 個樣本
+            self._train_min = max(settings.FAISS_TRAIN_MIN_VECTORS, nlist, 256)
+            if self._train_min > settings.FAISS_TRAIN_MIN_VECTORS:
+                logger.warning(
+                    f"FAISS_TRAIN_MIN_VECTORS ({settings.FAISS_TRAIN_MIN_VECTORS}) 少於 IVFPQ 訓練所需的樣本數，"
+                    f"改為累積 {self._train_min} 個向量後才訓練。"
+                )
+        elif settings.FAISS_QUANTIZE:
+            logger.info(f"建立新的 8-bit 純量量化 L2 索引 (維度: {dimension})。")
+            self.index = faiss.IndexScalarQuantizer(
+                dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2
+            )
         else:
-            logger.info(f"未找到 FAISS 索引檔，建立新的 L2 索引 (維度: {self.dimension})。")
-            self.index = faiss.IndexFlatL2(self.dimension)
+            if index_type != "flat":
+                logger.warning(f"未知的 FAISS_INDEX_TYPE '{settings.FAISS_INDEX_TYPE}'，改用 flat。")
+            logger.info(f"建立新的 L2 索引 (維度: {dimension})。")
+            self.index = faiss.IndexFlatL2(dimension)
+
+    def _search_params(self, allowed_ids: Optional[np.ndarray] = None):
+        """
+        依索引類型建立查詢參數 (包含從磁碟載入的索引)。
+
+        allowed_ids 不為 None 時附上 IDSelector，FAISS 只會回傳這些 id 的向量。
+        """
+        kwargs = {}
+        if allowed_ids is not None:
+            kwargs["sel"] = faiss.IDSelectorBatch(allowed_ids)
+        if isinstance(self.index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(efSearch=settings.HNSW_EF_SEARCH, **kwargs)
+        if isinstance(self.index, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(nprobe=settings.IVF_NPROBE, **kwargs)
+        return faiss.SearchParameters(**kwargs)
 
     def save(self):
-        if faiss and self.index is not None:
-            try:
+        """
+        先寫入暫存的向量再儲存索引；索引自上次儲存後沒有變動時不重寫檔案。
+
+        索引若仍在等待足夠的訓練樣本，則改為把暫存向量寫入 .pending.npy，下次執行時載入並繼續累積。
+        """
+        if not (faiss and self.index is not None):
+            return
+        self.flush()
+        if not self._dirty:
+            return
+        try:
+            if self.index.is_trained:
                 faiss.write_index(self.index, str(self.path))
                 logger.info(f"FAISS 索引已儲存至 {self.path} ({self.index.ntotal} 個向量)。")
-            except Exception as e:
-                logger.error(f"儲存 FAISS 索引失敗: {e}")
+                if self.pending_path.exists():
+                    self.pending_path.unlink()
+            else:
+                np.save(self.pending_path, self._pending_matrix())
+                logger.info(
+                    f"FAISS 索引尚未訓練 (需 {self._train_min} 個向量，目前 {self._pending_count} 個)，"
+                    f"暫存向量已儲存至 {self.pending_path}。"
+                )
+        except Exception as e:
+            logger.error(f"儲存 FAISS 索引失敗: {e}")
+            return
+        try:
+            self.payload_path.write_text(
+                json.dumps({str(k): v for k, v in self.payloads.items()}, ensure_ascii=False),
+                encoding="utf-8",
+            )
+        except Exception as e:
+            logger.error(f"儲存向量 payload 檔 {self.payload_path} 失敗: {e}")
+            return
+        self._dirty = False
 
-    def search(self, vec: List[float], k: int = 5) -> Tuple[List[int], List[float]]:
+    def search(self, vec: Union[List[float], np.ndarray], k: int = 5) -> Tuple[List[int], List[float]]:
         """回傳 (ids, dists)。若索引為空則回傳空列表。"""
-        if faiss is None or self.index is None or self.index.ntotal == 0:
+        ids, dists = self.search_batch(np.asarray(vec, dtype=np.float32).reshape(1, -1), k)
+        if ids.shape[1] == 0:
             return [], []
-        query_vector = np.array([vec], dtype=np.float32)
-        dists, ids = self.index.search(query_vector, k)
         return ids[0].tolist(), dists[0].tolist()
 
-    def add(self, vecs: List[List[float]]):
-        if faiss and self.index is not None:
-            vectors_to_add = np.array(vecs, dtype=np.float32)
-            self.index.add(vectors_to_add)
-            logger.debug(f"新增 {len(vecs)} 個向量到 FAISS。目前總數: {self.index.ntotal}")
+    def search_batch(
+        self, vecs: np.ndarray, k: int = 5, payload_only: bool = False
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        一次查詢形狀為 (B, dimension) 的多個向量，FAISS 會以單一矩陣運算計算所有距離。
+
+        查詢前會先 flush；需要訓練的索引在累積到足夠的樣本前，向量只存在暫存區，
+        此時改以 numpy 對暫存區做精確 L2 搜尋，因此等待訓練的向量與其 payload 一樣查得到。
+
+        Args:
+            vecs: 查詢向量。
+            k: 每個查詢回傳的鄰居數。
+            payload_only: 只搜尋帶有 payload 的向量。
+
+        Returns:
+            (ids, dists)，形狀皆為 (B, k)；若索引與暫存區皆為空則為 (B, 0)。
+            符合條件的向量不足 k 個時，不足的位置 id 為 -1。
+        """
+        query_vectors = np.array(vecs, dtype=np.float32, order="C", copy=True)
+        empty = np.empty((len(query_vectors), 0))
+        if faiss is None or self.index is None:
+            return empty.astype(np.int64), empty.astype(np.float32)
+        if query_vectors.shape[1] != self.index.d:
+            logger.error(f"查詢向量維度 {query_vectors.shape[1]} 與 FAISS 索引維度 {self.index.d} 不符，略過查詢。")
+            return empty.astype(np.int64), empty.astype(np.float32)
+        self.flush()
+        if self.index.ntotal == 0 and self._pending_count == 0:
+            return empty.astype(np.int64), empty.astype(np.float32)
+        faiss.normalize_L2(query_vectors)
+        allowed_ids = (
+            np.fromiter(self.payloads, dtype=np.int64, count=len(self.payloads)) if payload_only else None
+        )
+        if self._pending:
+            # flush 後仍有暫存向量代表索引尚未訓練 (ntotal 為 0)，暫存區即為全部的向量
+            return self._search_pending(query_vectors, k, allowed_ids)
+        dists, ids = self.index.search(query_vectors, k, params=self._search_params(allowed_ids))
+        return ids, dists
+
+    def _search_pending(
+        self, query_vectors: np.ndarray, k: int, allowed_ids: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """在暫存區中以精確 L2 搜尋已正規化的查詢向量，回傳格式與 ``faiss.Index.search`` 相同。"""
+        pending = self._pending_matrix()
+        # 兩者皆為單位向量，平方 L2 距離 = 2 - 2 * 內積
+        dists = np.maximum(2.0 - 2.0 * (query_vectors @ pending.T), 0.0).astype(np.float32)
+        if allowed_ids is not None:
+            mask = np.zeros(len(pending), dtype=bool)
+            positions = allowed_ids - self.index.ntotal
+            mask[positions[(positions >= 0) & (positions < len(pending))]] = True
+            dists[:, ~mask] = np.inf
+        order = np.argsort(dists, axis=1, kind="stable")[:, :k]
+        dists = np.take_along_axis(dists, order, axis=1)
+        ids = np.where(np.isinf(dists), -1, order.astype(np.int64) + self.index.ntotal)
+        return ids, dists
+
+    def search_with_payload(
+        self, vec: Union[List[float], np.ndarray], k: int = 5
+    ) -> Optional[Tuple[float, Dict[str, Any]]]:
+        """單一向量版本的 ``search_with_payload_batch``。"""
+        return self.search_with_payload_batch(np.asarray(vec, dtype=np.float32).reshape(1, -1), k)[0]
+
+    def search_with_payload_batch(
+        self, vecs: np.ndarray, k: int = 5
+    ) -> List[Optional[Tuple[float, Dict[str, Any]]]]:
+        """
+        對每個查詢向量，找出最近的帶有 payload 的向量。
+
+        搜尋只限帶有 payload 的向量 (FAISS IDSelector)，因此剛由 indexer 新增、尚未分析的
+        大量相似日誌 (例如同一波掃描) 不會佔滿 k 個鄰居而擋住已分析過的結果。
+        查詢與索引中的向量皆為單位長度，平方 L2 距離 d 與餘弦相似度的關係為 cos = 1 - d / 2。
+
+        Returns:
+            與 vecs 一一對應的 (餘弦相似度, payload)；沒有帶 payload 的鄰居則為 None。
+        """
+        self.flush()
+        if not self.payloads:
+            return [None] * len(vecs)
+        ids, dists = self.search_batch(vecs, k, payload_only=True)
+        results: List[Optional[Tuple[float, Dict[str, Any]]]] = []
+        for row_ids, row_dists in zip(ids.tolist(), dists.tolist()):
+            hit = None
+            for vec_id, dist in zip(row_ids, row_dists):
+                payload = self.payloads.get(vec_id)
+                if payload is not None:
+                    hit = (1.0 - dist / 2.0, payload)
+                    break
+            results.append(hit)
+        return results
+
+    def add(
+        self, vecs: np.ndarray, payloads: Optional[List[Optional[Dict[str, Any]]]] = None
+    ) -> Optional[np.ndarray]:
+        """
+        新增形狀為 (N, dimension) 的向量；ndarray 會直接交給 FAISS，不經 list 轉換。
+
+        向量先放入暫存區，累積達 FAISS_ADD_FLUSH 筆 (或呼叫 search / save) 時才一次寫入 FAISS。
+
+        Args:
+            vecs: 要新增的向量。
+            payloads: 可選，與 vecs 一一對應的 payload；None 表示該向量不帶 payload。
+
+        Returns:
+            新向量的 FAISS id；FAISS 無法使用或維度不符時為 None。
+        """
+        if faiss is None:
+            return None
+        # 複製一份再正規化，避免修改呼叫端的陣列 (暫存區也需要自己的副本)
+        vectors_to_add = np.array(vecs, dtype=np.float32, order="C", copy=True)
+        if self.index is None:
+            self._create_index(vectors_to_add.shape[1])
+        elif vectors_to_add.shape[1] != self.index.d:
+            logger.error(
+                f"向量維度 {vectors_to_add.shape[1]} 與既有 FAISS 索引維度 {self.index.d} 不符，"
+                "略過新增。若已更換嵌入模型，請刪除舊索引檔。"
+            )
+            return None
+        faiss.normalize_L2(vectors_to_add)
+        # FAISS 依序配發 id，暫存區的向量會依序接在目前的 ntotal 之後，因此 id 現在就能確定
+        first_id = self.index.ntotal + self._pending_count
+        if payloads is not None:
+            for offset, payload in enumerate(payloads):
+                if payload is not None:
+                    self.payloads[first_id + offset] = payload
+        self._pending.append(vectors_to_add)
+        self._pending_count += len(vectors_to_add)
+        self._dirty = True
+        if self._pending_count >= settings.FAISS_ADD_FLUSH:
+            self.flush()
+        return np.arange(first_id, first_id + len(vectors_to_add), dtype=np.int64)
+
+    def set_payloads(self, ids: List[int], payloads: List[Dict[str, Any]]):
+        """為已新增的向量 (包含仍在暫存區者) 附上或更新 payload，例如 LLM 分析完成後的結果。"""
+        for vec_id, payload in zip(ids, payloads):
+            self.payloads[int(vec_id)] = payload
+        if ids:
+            self._dirty = True
+
+    def _pending_matrix(self) -> np.ndarray:
+        """將暫存區合併成單一 (N, dimension) 陣列，並以合併後的陣列取代原本的多個區塊。"""
+        if len(self._pending) > 1:
+            self._pending = [np.concatenate(self._pending)]
+        return self._pending[0]
+
+    def flush(self):
+        """
+        將暫存的向量合併成單一陣列後一次新增到 FAISS。
+
+        需要訓練的索引在累積到足夠的樣本 (FAISS_TRAIN_MIN_VECTORS，IVFPQ 另需不少於 nlist) 之前維持暫存，
+        以免用過少的樣本估計量化範圍。暫存區只在訓練與新增都成功後才清空，失敗時向量不會遺失。
+        """
+        if not self._pending:
+            return
+        if not self.index.is_trained and self._pending_count < self._train_min:
+            return
+        vectors_to_add = self._pending_matrix()
+        if not self.index.is_trained:
+            # 量化 / IVF 索引需要先以資料估計數值範圍與分群中心
+            logger.info(f"以 {len(vectors_to_add)} 個向量訓練 FAISS 量化器。")
+            try:
+                self.index.train(vectors_to_add)
+            except Exception as e:
+                # 保留暫存向量，累積到兩倍的樣本數再重試，避免每次查詢都重複失敗的訓練
+                self._train_min = max(self._train_min, 2 * self._pending_count)
+                logger.error(f"訓練 FAISS 量化器失敗: {e}。暫存向量保留至累積 {self._train_min} 個後重試。")
+                return
+        self.index.add(vectors_to_add)
+        self._pending = []
+        self._pending_count = 0
+        self._dirty = True
+        logger.debug(f"新增 {len(vectors_to_add)} 個向量到 FAISS。目前總數: {self.index.ntotal}")
 
-VECTOR_DB = VectorIndex(settings.VECTOR_DB_PATH, settings.EMBED_DIM)
+VECTOR_DB = VectorIndex(settings.VECTOR_DB_PATH)
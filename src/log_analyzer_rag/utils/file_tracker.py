@@ -5,13 +5,34 @@ import gzip
 import io
 import json
 import logging
+import os
+import threading
+import time
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Any, BinaryIO, Dict, Iterator, List
 
 from ..core.config import settings
 
 logger = logging.getLogger(__name__)
 
+try:
+    import orjson
+except ImportError:
+    logger.info("未安裝 orjson，狀態檔將以標準 json 模組寫入。可執行: pip install orjson")
+    orjson = None
+
+try:
+    from isal import igzip as _gzip
+except ImportError:
+    logger.info("未安裝 python-isal，.gz 檔將以標準 gzip 模組解壓縮。可執行: pip install isal")
+    _gzip = gzip
+
+try:
+    import indexed_bzip2
+except ImportError:
+    logger.info("未安裝 indexed_bzip2，.bz2 檔將以標準 bz2 模組解壓縮。可執行: pip install indexed_bzip2")
+    indexed_bzip2 = None
+
 FileState = Dict[str, Dict[str, Any]]
 
 def load_log_state() -> FileState:
@@ -28,55 +49,164 @@ def load_log_state() -> FileState:
     return {}
 
 def save_log_state(state: FileState):
-    """將日誌檔案的處理狀態儲存至 JSON 檔案"""
+    """
+    將日誌檔案的處理狀態儲存至 JSON 檔案。
+
+    先寫入同目錄的暫存檔再以 os.replace 取代，寫入途中中斷也不會留下損毀的狀態檔。
+    """
+    global _STATE_DIRTY, _LAST_FLUSH
+    tmp_path = settings.LOG_STATE_FILE.with_suffix(".tmp")
     try:
-        settings.LOG_STATE_FILE.write_text(json.dumps(state, indent=2), encoding='utf-8')
+        with _STATE_LOCK:
+            if orjson is not None:
+                data = orjson.dumps(state, option=orjson.OPT_INDENT_2)
+            else:
+                data = json.dumps(state, indent=2).encode("utf-8")
+            _STATE_DIRTY = False
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, settings.LOG_STATE_FILE)
+        _LAST_FLUSH = time.monotonic()
         logger.debug(f"檔案狀態已儲存至 {settings.LOG_STATE_FILE}。")
     except Exception as e:
+        _STATE_DIRTY = True
         logger.error(f"儲存檔案狀態至 {settings.LOG_STATE_FILE} 失敗: {e}")
 
+def maybe_save_log_state():
+    """STATE 有變動且距離上次儲存已超過 STATE_FLUSH_INTERVAL_S 秒時才寫入狀態檔"""
+    if _STATE_DIRTY and time.monotonic() - _LAST_FLUSH >= settings.STATE_FLUSH_INTERVAL_S:
+        save_log_state(STATE)
+
 STATE = load_log_state()
+# tail_since 可能在多個執行緒中同時呼叫，讀寫 STATE 時需持有此鎖
+_STATE_LOCK = threading.Lock()
+# STATE 自上次寫入狀態檔後是否有變動，以及上次寫入的時間 (time.monotonic())
+_STATE_DIRTY = False
+_LAST_FLUSH = 0.0
+
+# 讀取日誌檔案的緩衝區大小；預設 8 KB 的緩衝會讓解壓縮與逐行迭代頻繁回到 Python 層
+READ_BUFFER_SIZE = 1 << 20
+# 每次讀入並整塊解碼的區塊大小 (於換行處切齊)，限制單次解碼的記憶體用量
+READ_CHUNK_SIZE = 4 << 20
+COMPRESSED_SUFFIXES = (".gz", ".bz2")
 
 def open_log_file(path: Path) -> io.BufferedReader:
-    """根據副檔名打開可能被壓縮的日誌檔案"""
+    """
+    根據副檔名打開可能被壓縮的日誌檔案，並以較大的緩衝區包裝。
+
+    有安裝時 .gz 改用 ISA-L (isal.igzip) 的 SIMD 解壓縮、.bz2 改用 indexed_bzip2 的多執行緒解壓縮，
+    兩者都提供與標準模組相同的 seek / tell 介面。
+    """
     if path.suffix == ".gz":
-        return gzip.open(path, "rb")  # type: ignore
+        return io.BufferedReader(_gzip.open(path, "rb"), buffer_size=READ_BUFFER_SIZE)  # type: ignore[arg-type]
     if path.suffix == ".bz2":
-        return bz2.open(path, "rb")  # type: ignore
-    return path.open("rb")
+        if indexed_bzip2 is not None:
+            # 最多會有 LMS_MAX_READ_WORKERS 個檔案同時解壓縮，平分核心數以免解碼執行緒超額訂閱
+            parallelization = max(1, (os.cpu_count() or 1) // max(1, settings.LMS_MAX_READ_WORKERS))
+            return indexed_bzip2.open(str(path), parallelization=parallelization)
+        return io.BufferedReader(bz2.BZ2File(path, "rb"), buffer_size=READ_BUFFER_SIZE)  # type: ignore[arg-type]
+    return path.open("rb", buffering=READ_BUFFER_SIZE)
 
-def tail_since(path: Path) -> List[str]:
-    """從上次讀取的位置繼續讀取檔案的新增內容"""
+def _iter_block_lines(f: BinaryIO, stored: Dict[str, Any], keep_partial_line: bool) -> Iterator[str]:
+    """
+    自 stored["offset"] 起以固定大小的區塊讀取 f，逐行產生內容並隨之推進 stored["offset"]。
+
+    區塊讀入同一個可重複使用的緩衝區，於最後一個換行處切齊後整塊解碼再切行，
+    省去逐行建立 bytes 物件的負擔；換行之後的殘餘位元組搬到緩衝區開頭，與下一塊接續。
+    每一塊的行全部產生後才推進 offset，因此讀取中途失敗時 offset 停在最後一個完整產生的行之後。
+
+    Args:
+        f: 以二進位模式開啟的檔案 (未壓縮檔或解壓縮串流)。
+        stored: 此檔案在 STATE 中的狀態，會就地更新 "offset"。
+        keep_partial_line: 為 True 時，檔案結尾沒有換行的最後一行留待下次讀取 (可能仍在寫入)；
+            為 False 時 (已輪替的壓縮檔) 一併產生。
+    """
+    pos = stored["offset"]
+    f.seek(pos)
+    buf = bytearray(READ_CHUNK_SIZE)
+    view = memoryview(buf)
+    filled = 0
+    try:
+        while True:
+            if filled == len(buf):
+                # 單行超過緩衝區大小：加大緩衝區 (調整大小前須先釋放 memoryview)
+                view.release()
+                buf.extend(bytes(len(buf)))
+                view = memoryview(buf)
+            n = f.readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+            newline = buf.rfind(b"\n", 0, filled)
+            if newline < 0:
+                continue
+            # UTF-8 的多位元組序列不會包含 0x0A，整塊解碼後再切行與逐行解碼結果相同
+            for line in str(view[:newline], "utf-8", "replace").split("\n"):
+                yield line.rstrip()
+            consumed = newline + 1
+            pos += consumed
+            stored["offset"] = pos
+            buf[:filled - consumed] = buf[consumed:filled]
+            filled -= consumed
+        if filled and not keep_partial_line:
+            yield str(view[:filled], "utf-8", "replace").rstrip()
+            stored["offset"] = pos + filled
+    finally:
+        view.release()
+
+def iter_since(path: Path) -> Iterator[str]:
+    """
+    從上次讀取的位置逐行產生檔案的新增內容。
+
+    產生器被完整讀完後才會更新 STATE 中的 offset；若中途停止迭代，下次會從原位置重新讀取。
+    若讀取途中發生錯誤，offset 會停在最後一個已產生的行之後，已產生的行不會被重複讀取。
+    未壓縮檔案只讀到最後一個換行為止，尚未寫完的最後一行留待下次讀取。
+    若 inode、大小與修改時間都與上次讀完時相同，直接結束而不開檔 (壓縮檔也不必重新初始化解壓縮器)。
+    """
     try:
-        inode = path.stat().st_ino
+        st = path.stat()
     except FileNotFoundError:
         logger.warning(f"日誌檔案 {path} 不存在，跳過處理。")
-        return []
+        return
+    inode = st.st_ino
 
     file_key = str(path.resolve())
-    stored = STATE.get(file_key, {"inode": inode, "offset": 0})
+    with _STATE_LOCK:
+        stored = dict(STATE.get(file_key, {"inode": inode, "offset": 0}))
 
     if stored["inode"] != inode:
         logger.info(f"日誌檔案 {path} inode 發生變化 (從 {stored['inode']} 到 {inode})，視為新檔案並從頭讀取。")
         stored = {"inode": inode, "offset": 0}
+    elif stored.get("size") == st.st_size and stored.get("mtime_ns") == st.st_mtime_ns:
+        return
 
-    new_lines: List[str] = []
+    line_count = 0
+    compressed = path.suffix in COMPRESSED_SUFFIXES
     try:
-        with open_log_file(path) as f:
-            f.seek(stored["offset"])
-            for line_bytes in f:
-                try:
-                    new_lines.append(line_bytes.decode("utf-8").rstrip())
-                except UnicodeDecodeError:
-                    decoded_line = line_bytes.decode("utf-8", "replace").rstrip()
-                    logger.warning(f"檔案 {path} 中存在 Unicode 解碼錯誤。已使用 'replace' 處理。")
-                    new_lines.append(decoded_line)
-            stored["offset"] = f.tell()
+        # 未壓縮檔直接以無緩衝的 readinto 讀入區塊；壓縮檔則讀取解壓縮後的串流
+        with (open_log_file(path) if compressed else path.open("rb", buffering=0)) as f:
+            for line in _iter_block_lines(f, stored, keep_partial_line=not compressed):
+                line_count += 1
+                yield line
+        # 記錄開始讀取前的大小與修改時間；讀取期間若檔案又有寫入，下次比對時會不同而重新讀取
+        stored["size"] = st.st_size
+        stored["mtime_ns"] = st.st_mtime_ns
     except Exception as e:
         logger.error(f"讀取日誌檔案 {path} 失敗: {e}")
-        return []
+        if not line_count:
+            return
+        # 已產生的行已交給下游評分與分析，保留推進到這些行之後的 offset，避免下次重複分析與匯出；
+        # 不記錄大小與修改時間，下次仍會重新嘗試讀取剩餘的內容
+        stored.pop("size", None)
+        stored.pop("mtime_ns", None)
+        logger.warning(f"保留 {path.name} 已讀取的 {line_count} 行進度，offset: {stored['offset']}")
+
+    global _STATE_DIRTY
+    with _STATE_LOCK:
+        STATE[file_key] = stored
+        _STATE_DIRTY = True
+    if line_count:
+        logger.info(f"從 {path.name} 讀取到 {line_count} 行新日誌。目前 offset: {stored['offset']}")
 
-    STATE[file_key] = stored
-    if new_lines:
-        logger.info(f"從 {path.name} 讀取到 {len(new_lines)} 行新日誌。目前 offset: {stored['offset']}")
-    return new_lines
+def tail_since(path: Path) -> List[str]:
+    """從上次讀取的位置繼續讀取檔案的新增內容"""
+    return list(iter_since(path))
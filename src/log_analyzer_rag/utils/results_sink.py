@@ -0,0 +1,61 @@
+"""Append-only NDJSON sink for exported analysis results."""
+
+import atexit
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, IO, List, Optional
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 寫入緩衝區大小與每次寫入的最大筆數 (限制組字串時的記憶體峰值)
+EXPORT_BUFFER_SIZE = 1 << 20
+EXPORT_CHUNK_SIZE = 10_000
+
+class ResultsSink:
+    """
+    保持開啟的 NDJSON 結果檔 (一行一筆 JSON)。
+
+    檔案在第一次寫入時才以附加模式開啟，之後的每次寫入都重用同一個檔案控制代碼，
+    不必在每批結果都重新 open/close。使用完畢需呼叫 ``close()`` 或以 ``with`` 管理。
+    """
+
+    def __init__(self, output_file: Path):
+        self.output_file = output_file
+        self._fh: Optional[IO[str]] = None
+
+    def __enter__(self) -> "ResultsSink":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _open(self) -> IO[str]:
+        if self._fh is None:
+            self.output_file.parent.mkdir(parents=True, exist_ok=True)
+            self._fh = open(self.output_file, "a", encoding="utf-8", buffering=EXPORT_BUFFER_SIZE)
+        return self._fh
+
+    def write(self, records: List[Dict[str, Any]]):
+        """將多筆結果以區塊為單位組成字串後寫入，並在結束時 flush。"""
+        if not records:
+            return
+        fh = self._open()
+        for start in range(0, len(records), EXPORT_CHUNK_SIZE):
+            chunk = records[start:start + EXPORT_CHUNK_SIZE]
+            fh.write("\n".join(json.dumps(rec, ensure_ascii=False) for rec in chunk) + "\n")
+        fh.flush()
+
+    def close(self):
+        if self._fh is not None:
+            try:
+                self._fh.close()
+            except Exception as e:
+                logger.error(f"關閉分析結果檔案 {self.output_file} 失敗: {e}")
+            finally:
+                self._fh = None
+
+RESULTS_SINK = ResultsSink(settings.LMS_ANALYSIS_OUTPUT_FILE)
+atexit.register(RESULTS_SINK.close)
@@ -0,0 +1,118 @@
+"""iter_since 以區塊讀取時的 offset 處理：未結束的最後一行、超長行、壓縮檔結尾與讀取失敗。"""
+
+import bz2
+import gzip
+import io
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from src.log_analyzer_rag.utils import file_tracker
+
+
+class _FailingReader(io.FileIO):
+    """讀取 ok_reads 次之後的 readinto 會拋出 OSError，模擬讀取途中的 I/O 錯誤。"""
+
+    def __init__(self, path, ok_reads):
+        super().__init__(path, "rb")
+        self.ok_reads = ok_reads
+
+    def readinto(self, b):
+        if self.ok_reads <= 0:
+            raise OSError("simulated read error")
+        self.ok_reads -= 1
+        return super().readinto(b)
+
+
+class IterSinceTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        for patcher in (
+            mock.patch.dict(file_tracker.STATE, clear=True),
+            mock.patch.object(file_tracker, "READ_CHUNK_SIZE", 64),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _offset(self, path):
+        return file_tracker.STATE[str(path.resolve())]["offset"]
+
+    def _write(self, name, data):
+        path = self.dir / name
+        path.write_bytes(data)
+        return path
+
+    def test_unterminated_last_line_is_held_back(self):
+        path = self._write("a.log", b"first\nsecond\npart")
+        self.assertEqual(list(file_tracker.iter_since(path)), ["first", "second"])
+        self.assertEqual(self._offset(path), len(b"first\nsecond\n"))
+
+        with path.open("ab") as f:
+            f.write(b"ial\nthird\n")
+        self.assertEqual(list(file_tracker.iter_since(path)), ["partial", "third"])
+        self.assertEqual(self._offset(path), path.stat().st_size)
+        self.assertEqual(list(file_tracker.iter_since(path)), [])
+
+    def test_lines_longer_than_chunk(self):
+        lines = ["a" * 10, "b" * 300, "", "c" * 65, "é" * 100]
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        path = self._write("long.log", data)
+        self.assertEqual(list(file_tracker.iter_since(path)), lines)
+        self.assertEqual(self._offset(path), len(data))
+
+    def test_invalid_utf8_and_crlf(self):
+        path = self._write("bad.log", b"ok\r\n\xff\xfe bad\nend\n")
+        self.assertEqual(list(file_tracker.iter_since(path)), ["ok", "�� bad", "end"])
+
+    def test_compressed_tail_is_yielded(self):
+        lines = [f"line {i}:" + "x" * (i % 90) for i in range(500)]
+        data = "\n".join(lines).encode("utf-8")
+        # 有安裝時使用 isal / indexed_bzip2，另以標準模組再跑一次
+        backends = {
+            "optional": {"_gzip": file_tracker._gzip, "indexed_bzip2": file_tracker.indexed_bzip2},
+            "stdlib": {"_gzip": gzip, "indexed_bzip2": None},
+        }
+        for name, opener in (("a.gz", gzip.open), ("a.bz2", bz2.open)):
+            for backend, modules in backends.items():
+                with self.subTest(name=name, backend=backend), mock.patch.multiple(file_tracker, **modules):
+                    file_tracker.STATE.clear()
+                    path = self.dir / name
+                    with opener(path, "wb") as f:
+                        f.write(data)
+                    self.assertEqual(list(file_tracker.iter_since(path)), lines)
+                    self.assertEqual(self._offset(path), len(data))
+
+    def test_failed_read_keeps_progress(self):
+        lines = [f"{i:04d} " + "y" * 40 for i in range(40)]
+        path = self._write("fail.log", ("\n".join(lines) + "\n").encode("utf-8"))
+        real_open = Path.open
+
+        def failing_open(self, mode="r", buffering=-1, *args, **kwargs):
+            if self == path and mode == "rb":
+                return _FailingReader(self, ok_reads=5)
+            return real_open(self, mode, buffering, *args, **kwargs)
+
+        with mock.patch.object(Path, "open", failing_open):
+            first = list(file_tracker.iter_since(path))
+        self.assertTrue(0 < len(first) < len(lines))
+        self.assertEqual(first, lines[: len(first)])
+        stored = file_tracker.STATE[str(path.resolve())]
+        self.assertEqual(stored["offset"], sum(len(line) + 1 for line in first))
+        self.assertNotIn("size", stored)
+
+        # 下次從中斷處繼續，已產生的行不會重複
+        self.assertEqual(first + list(file_tracker.iter_since(path)), lines)
+
+    def test_failed_read_before_any_line_keeps_state(self):
+        path = self._write("fail0.log", b"one\ntwo\n")
+        with mock.patch.object(Path, "open", lambda self, *a, **k: _FailingReader(self, ok_reads=0)):
+            self.assertEqual(list(file_tracker.iter_since(path)), [])
+        self.assertNotIn(str(path.resolve()), file_tracker.STATE)
+        self.assertEqual(list(file_tracker.iter_since(path)), ["one", "two"])
+
+
+if __name__ == "__main__":
+    unittest.main()
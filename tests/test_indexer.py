@@ -0,0 +1,50 @@
+"""index_candidates 的抽樣必須與原本「依分數穩定排序後取前 K 筆」的結果相同。"""
+
+import random
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from src.log_analyzer_rag.data_processing import indexer
+
+
+def _stable_top(scores, candidates, k):
+    ranked = sorted(zip(scores.tolist(), candidates), key=lambda x: x[0], reverse=True)
+    return [line for _, line in ranked[:k]]
+
+
+class IndexCandidatesTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(indexer, "VECTOR_DB", mock.Mock(enabled=False))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _select(self, scores, percent):
+        candidates = [f"line {i}" for i in range(len(scores))]
+        with mock.patch.object(indexer.settings, "LMS_SAMPLE_TOP_PERCENT", percent):
+            top, line_vectors = indexer.index_candidates(scores, candidates)
+        self.assertEqual(line_vectors, {})
+        k = max(1, int(len(scores) * percent / 100))
+        return [line for _, line in top], _stable_top(scores, candidates, k)
+
+    def test_ties_keep_earliest_lines(self):
+        scores = np.full(1000, 0.2, dtype=np.float32)
+        selected, expected = self._select(scores, 20)
+        self.assertEqual(selected, expected)
+        self.assertEqual(selected[0], "line 0")
+
+    def test_matches_stable_sort(self):
+        rng = random.Random(0)
+        for _ in range(50):
+            n = rng.randint(1, 500)
+            scores = np.array([rng.randint(1, 10) / 10 for _ in range(n)], dtype=np.float32)
+            selected, expected = self._select(scores, rng.choice([1, 20, 50, 100]))
+            self.assertEqual(selected, expected)
+
+    def test_no_candidates(self):
+        self.assertEqual(indexer.index_candidates(np.empty(0, dtype=np.float32), []), ([], {}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+"""fast_score_batch 必須與逐行的 fast_score 給出相同分數，且兩者都符合原始規則的固定分數。"""
+
+import random
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from src.log_analyzer_rag.data_processing import scoring
+from src.log_analyzer_rag.data_processing.scoring import fast_score, fast_score_batch
+
+_FRAGMENTS = [
+    '1.2.3.4 - - [x] ', '"GET / HTTP/1.1" ', '"POST /login HTTP/1.1"', ' 200 ', ' 404', '\t500\t',
+    ' 2001 ', ' 20 ', '"', ' resp_time:2.5', ' resp_time: 2.5', ' resp_time:1e3', ' resp_time:1.5s',
+    ' resp_time:0.3"', ' resp_time:', '/etc/passwd', '<SCRIPT>', ' or ', 'union select ', 'CONCAT(',
+    ' "sqlmap/1.0"', ' "curl/8.0"', ' "Mozilla/5.0"', 'Python-Requests', ' ', 'é', '١٢٣',
+]
+
+# 以原始 (逐一子字串檢查) 版本的 fast_score 算出的分數；後三組測試共用空白的重疊關鍵字
+_EXPECTED = [
+    ('1.2.3.4 - - [10/Oct/2024:13:55:36 +0000] "GET /index.html HTTP/1.1" 200 512 "-" "Mozilla/5.0"', 0.0),
+    ('1.2.3.4 - - [x] "GET /missing HTTP/1.1" 404 0 "-" "Mozilla/5.0"', 0.4),
+    ('1.2.3.4 - - [x] "GET /etc/passwd HTTP/1.1" 403 0 "-" "sqlmap/1.0"', 0.7),
+    ('1.2.3.4 - - [x] "GET /?q=<script>alert(1)</script> HTTP/1.1" 200 10 "-" "curl/8.0"', 0.3),
+    ('1.2.3.4 - - [x] "GET /?q=UNION SELECT CONCAT(a) FROM t%20OR%201 HTTP/1.1" 200 1 "-" "Nikto"', 0.6),
+    ('1.2.3.4 - - [x] "GET / HTTP/1.1" 200 1 "-" "Mozilla/5.0" resp_time:2.5', 0.2),
+    ('1.2.3.4 - - [x] "GET / HTTP/1.1" 200 1 "-" "Mozilla/5.0" resp_time:0.3', 0.0),
+    ('1.2.3.4 - - [x] "GET / HTTP/1.1" 302 1 "-" "nmap scripting engine"', 0.2),
+    ("garbage line without quotes", 0.0),
+    ("", 0.0),
+    ('1.2.3.4 - - [x] "GET /?id=1 union or 1=1 HTTP/1.1" 200 10 "-" "Mozilla/5.0"', 0.2),
+    ('1.2.3.4 - - [x] "GET /?q=select or x HTTP/1.1" 200 10 "-" "Mozilla/5.0"', 0.2),
+    ('1.2.3.4 - - [x] "POST /?q=insert or x HTTP/1.1" 500 10 "-" "python-requests/2.31"', 0.8),
+]
+
+
+class FastScoreBatchTest(unittest.TestCase):
+    def test_expected_scores(self):
+        lines = [line for line, _ in _EXPECTED]
+        expected = np.array([score for _, score in _EXPECTED], dtype=np.float32)
+        np.testing.assert_allclose([fast_score(line) for line in lines], expected, atol=1e-6)
+        np.testing.assert_allclose(fast_score_batch(lines), expected, atol=1e-6)
+
+    def test_matches_fast_score(self):
+        rng = random.Random(0)
+        lines = [
+            "".join(rng.choice(_FRAGMENTS) for _ in range(rng.randint(0, 8)))
+            for _ in range(5000)
+        ]
+        expected = np.array([fast_score(line) for line in lines], dtype=np.float32)
+        np.testing.assert_allclose(fast_score_batch(lines), expected, atol=1e-6)
+
+    def test_response_time_variants(self):
+        lines = [
+            '"GET / HTTP/1.1" 200 1 resp_time: 2.5',
+            '"GET / HTTP/1.1" 200 1 resp_time:1e3',
+            '"GET / HTTP/1.1" 200 1 resp_time:1.5s',
+        ]
+        expected = np.array([fast_score(line) for line in lines], dtype=np.float32)
+        np.testing.assert_allclose(fast_score_batch(lines), expected, atol=1e-6)
+
+    def test_empty_batch(self):
+        self.assertEqual(fast_score_batch([]).shape, (0,))
+
+
+class FastScoreBatchWithoutAutomatonTest(FastScoreBatchTest):
+    """未安裝 pyahocorasick 時的子字串比對路徑必須給出相同的分數。"""
+
+    def setUp(self):
+        patcher = mock.patch.object(scoring, "_AC", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""語意快取：indexer 先新增的大量相似日誌不應擋住已分析過的結果。"""
+
+import json
+import tempfile
+import unittest
+import zlib
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from src.log_analyzer_rag.data_processing import indexer
+from src.log_analyzer_rag.rag_pipeline import llm
+from src.log_analyzer_rag.rag_pipeline.cache import LRUCache
+from src.log_analyzer_rag.rag_pipeline.vector_store import VectorIndex
+
+_DIM = 32
+_BASE = np.random.default_rng(0).standard_normal(_DIM).astype(np.float32)
+_ANALYSIS = {"is_attack": True, "attack_type": "Path Traversal", "reason": "test", "severity": "High"}
+
+
+def _fake_embed(lines):
+    """以日誌內容決定的微小擾動產生與 _BASE 幾乎相同 (cos ≈ 0.9999) 的向量。"""
+    vectors = []
+    for line in lines:
+        rng = np.random.default_rng(zlib.crc32(line.encode("utf-8")))
+        vectors.append(_BASE + 0.01 * rng.standard_normal(_DIM).astype(np.float32))
+    return np.stack(vectors)
+
+
+class SemanticCacheBurstTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db = VectorIndex(Path(tmp.name) / "faiss.index")
+        self.calls = []
+
+        def fake_batch(entries):
+            self.calls.extend(entries)
+            for i in range(len(entries)):
+                yield i, (json.dumps(_ANALYSIS), 10, 5)
+
+        for patcher in (
+            mock.patch.object(indexer, "VECTOR_DB", self.db),
+            mock.patch.object(llm, "VECTOR_DB", self.db),
+            mock.patch.object(indexer, "embed_lines", _fake_embed),
+            mock.patch.object(llm, "embed_lines", _fake_embed),
+            mock.patch.object(llm, "CACHE", LRUCache(100)),
+            mock.patch.object(llm, "LLM_ENABLED", True),
+            mock.patch.object(llm, "_query_ollama_batch", fake_batch),
+            mock.patch.object(llm.settings, "LMS_SAMPLE_TOP_PERCENT", 100),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _run(self, lines):
+        top, line_vectors = indexer.index_candidates(np.full(len(lines), 0.5, dtype=np.float32), lines)
+        return llm.llm_analyse([line for _, line in top], line_vectors)
+
+    def test_burst_of_near_duplicates_hits_cache(self):
+        self._run(['6.6.6.6 "GET /etc/passwd HTTP/1.1" 404'])
+        self.assertEqual(len(self.calls), 1)
+
+        burst = [f'6.6.6.{i} "GET /etc/passwd?{i} HTTP/1.1" 404' for i in range(30)]
+        results = self._run(burst)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(results, [_ANALYSIS] * len(burst))
+        # 每行日誌只有一個向量，且全部都附上了分析結果
+        self.assertEqual(self.db.ntotal, 31)
+        self.assertEqual(len(self.db.payloads), 31)
+
+    def test_vectors_without_payload_are_skipped(self):
+        self.db.add(_fake_embed(["a", "b"]))
+        self.assertEqual(self.db.search_with_payload_batch(_fake_embed(["c"])), [None])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+"""VectorIndex 的暫存區、id 配發、payload 與側檔 (.pending.npy / .payloads.json) 行為。"""
+
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from src.log_analyzer_rag.core.config import settings
+from src.log_analyzer_rag.rag_pipeline.vector_store import VectorIndex, faiss
+
+_DIM = 16
+
+
+def _vectors(n, seed):
+    vecs = np.random.default_rng(seed).standard_normal((n, _DIM)).astype(np.float32)
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+def _reconstruct(index, vec_id):
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct(int(vec_id))
+
+
+@unittest.skipIf(faiss is None, "faiss 未安裝")
+class VectorIndexTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "faiss.index"
+
+    def _settings(self, **overrides):
+        patcher = mock.patch.multiple(settings, **overrides)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _ivfpq(self, train_min=300):
+        self._settings(FAISS_INDEX_TYPE="ivfpq", FAISS_IVF_NLIST=16, FAISS_TRAIN_MIN_VECTORS=train_min)
+
+    def test_add_ids_match_faiss_ids_after_flush(self):
+        self._settings(FAISS_INDEX_TYPE="flat", FAISS_ADD_FLUSH=100)
+        db = VectorIndex(self.path)
+        batches = [_vectors(n, seed) for seed, n in enumerate((30, 50, 70, 5))]
+        ids = [db.add(batch) for batch in batches]
+        db.flush()
+        self.assertEqual(db.index.ntotal, 155)
+        self.assertEqual(np.concatenate(ids).tolist(), list(range(155)))
+        for batch, batch_ids in zip(batches, ids):
+            for vec, vec_id in zip(batch, batch_ids):
+                np.testing.assert_allclose(_reconstruct(db.index, vec_id), vec, atol=1e-6)
+
+    def test_ids_assigned_while_untrained_survive_training(self):
+        self._ivfpq()
+        db = VectorIndex(self.path)
+        first = _vectors(200, 0)
+        first_ids = db.add(first)
+        self.assertFalse(db.index.is_trained)
+        second_ids = db.add(_vectors(200, 1))
+        db.flush()
+        self.assertTrue(db.index.is_trained)
+        self.assertEqual(db.index.ntotal, 400)
+        self.assertEqual(first_ids.tolist(), list(range(200)))
+        self.assertEqual(second_ids.tolist(), list(range(200, 400)))
+        # PQ 只保留近似值，確認每個 id 重建出的向量最接近自己原本的向量
+        recon = np.stack([_reconstruct(db.index, i) for i in first_ids[:20]])
+        nearest = np.argmin(((recon[:, None, :] - first[None, :, :]) ** 2).sum(-1), axis=1)
+        self.assertEqual(nearest.tolist(), list(range(20)))
+
+    def test_save_reload_and_train_cycle(self):
+        self._ivfpq()
+        db = VectorIndex(self.path)
+        db.add(_vectors(200, 0), [{"n": i} for i in range(200)])
+        db.save()
+        self.assertTrue(db.pending_path.exists())
+        self.assertFalse(self.path.exists())
+
+        reloaded = VectorIndex(self.path)
+        self.assertEqual(reloaded.ntotal, 200)
+        self.assertEqual(len(reloaded.payloads), 200)
+        ids = reloaded.add(_vectors(150, 1), [{"n": 200 + i} for i in range(150)])
+        self.assertEqual(ids.tolist(), list(range(200, 350)))
+        reloaded.save()
+        self.assertTrue(reloaded.index.is_trained)
+        self.assertTrue(self.path.exists())
+        self.assertFalse(reloaded.pending_path.exists())
+
+        final = VectorIndex(self.path)
+        self.assertEqual(final.index.ntotal, 350)
+        self.assertEqual(final.ntotal, 350)
+        self.assertEqual(final.payloads[349], {"n": 349})
+
+    def test_payload_lookup_before_and_after_training(self):
+        self._ivfpq()
+        db = VectorIndex(self.path)
+        vecs = _vectors(400, 0)
+        db.add(vecs[:200], [{"n": i} for i in range(200)])
+        self.assertFalse(db.index.is_trained)
+        hit = db.search_with_payload(vecs[7])
+        self.assertEqual(hit[1], {"n": 7})
+        self.assertAlmostEqual(hit[0], 1.0, places=5)
+
+        db.add(vecs[200:])
+        db.set_payloads([250], [{"n": 250}])
+        db.flush()
+        self.assertTrue(db.index.is_trained)
+        self.assertEqual(db.search_with_payload(vecs[7])[1], {"n": 7})
+        self.assertEqual(db.search_with_payload(vecs[250])[1], {"n": 250})
+
+    def test_failed_training_keeps_buffer(self):
+        self._ivfpq()
+        db = VectorIndex(self.path, _DIM)
+        db.add(_vectors(300, 0), [{"n": i} for i in range(300)])
+        with mock.patch.object(db, "index", mock.Mock(wraps=db.index, is_trained=False, ntotal=0, d=_DIM)) as index:
+            index.train.side_effect = RuntimeError("boom")
+            db.flush()
+        self.assertEqual(db.ntotal, 300)
+        self.assertEqual(db._train_min, 600)
+        db.save()
+        self.assertEqual(VectorIndex(self.path).ntotal, 300)
+
+    def test_ivfpq_train_min_covers_nlist(self):
+        self._ivfpq(train_min=10)
+        db = VectorIndex(self.path, _DIM)
+        self.assertEqual(db._train_min, 256)
+        db.add(_vectors(100, 0))
+        db.flush()
+        self.assertFalse(db.index.is_trained)
+        self.assertEqual(db.ntotal, 100)
+
+    def test_dimension_mismatch(self):
+        self._settings(FAISS_INDEX_TYPE="flat")
+        db = VectorIndex(self.path)
+        db.add(_vectors(10, 0))
+        self.assertIsNone(db.add(np.ones((2, _DIM + 1), dtype=np.float32)))
+        ids, dists = db.search_batch(np.ones((3, _DIM + 1), dtype=np.float32))
+        self.assertEqual(ids.shape, (3, 0))
+        self.assertEqual(db.ntotal, 10)
+
+    def test_save_skips_unchanged_index(self):
+        self._settings(FAISS_INDEX_TYPE="flat")
+        db = VectorIndex(self.path)
+        db.add(_vectors(10, 0))
+        db.save()
+        self.assertTrue(self.path.exists())
+        with mock.patch.object(faiss, "write_index") as write_index:
+            db.save()
+        write_index.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()